@@ -14,8 +14,13 @@ import os
 import pathlib
 import time
 
-from PIL import Image
 import pillow_heif
+from PIL import Image
+
+import cpu_usage
+import encode_cache
+import frame_reader
+import run_environment
 
 
 # Setting parameters
@@ -28,10 +33,27 @@ OUTPUT_PATH = pathlib.Path("logs", str(int(time.time())))
 QUALITY_SETTINGS = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
 CHROMA_SETTINGS = [420, 422, 444]
 
+# Encode cache, results of a cache hit include the timing of the run that created the entry
+# so the cache must be disabled for timing runs
+USE_ENCODE_CACHE = False
+CACHE_ENCODED_BYTES = False
+ENCODE_CACHE_PATH = pathlib.Path("logs", "encode_cache")
+ENCODE_CACHE_MAX_SIZE_B = 1 << 30  # 1 GiB
+
+# Time between samples of CPU frequency, load and throttling
+MONITOR_INTERVAL_S = 0.5
+
+# Frames are decoded ahead of the encode loop in a background thread
+PREFETCH_DEPTH = 8  # 0 decodes each frame synchronously
+PREFETCH_MAX_MEMORY_B = 512 << 20  # 512 MiB
+
 # Keys for dictionary entries
 MAX_TIME_MS = "max_time_ms"
 MIN_TIME_MS = "min_time_ms"
 AVG_TIME_MS = "avg_time_ms"
+AVG_CPU_TIME_MS = "avg_cpu_time_ms"
+AVG_CORES_USED = "avg_cores_used"
+AVG_CPU_UTILIZATION = "avg_cpu_utilization_%"
 MAX_SIZE_B = "max_size_B"
 MIN_SIZE_B = "min_size_B"
 AVG_SIZE_B = "avg_size_B"
@@ -39,6 +61,11 @@ MAX_SIZE_RATIO_COMPRESSED_TO_ORIGINAL = "max_size_ratio_compressed_to_original_%
 MIN_SIZE_RATIO_COMPRESSED_TO_ORIGINAL = "min_size_ratio_compressed_to_original_%"
 AVG_SIZE_RATIO_COMPRESSED_TO_ORIGINAL = "avg_size_ratio_compressed_to_original_%"
 FRAME_DATA = "frame_data"
+START_TIME_NS = "start_time_ns"
+END_TIME_NS = "end_time_ns"
+CONTENTION = "contention"
+IO_STALL_TIME_MS = "io_stall_time_ms"
+CACHED_FRAME_COUNT = "cached_frame_count"
 
 # For output csv file
 HEADERS = [
@@ -47,12 +74,18 @@ HEADERS = [
     "Min Time (ms)",
     "Max Time (ms)",
     "Avg Time (ms)",
+    "Avg CPU Time (ms)",
+    "Avg Cores Used",
+    "Avg CPU Utilization (%)",
     "Min Size (B)",
     "Max Size (B)",
     "Avg Size (B)",
     "Min Size Ratio (compressed to original in %)",
     "Max Size Ratio (compressed to original in %)",
     "Avg Size Ratio (compressed to original in %)",
+    "IO Stall Time (ms)",
+    "Cached Frames",
+    "Contended",
 ]
 HEADER_LINE = ",".join(HEADERS) + "\n"
 
@@ -86,6 +119,44 @@ def update_min_max(
     return min_value, max_value
 
 
+def get_settings() -> "list[tuple[list[str], dict]]":
+    """
+    Settings of the benchmark, in the order they are run.
+
+    Returns: list of (keys, parameters)
+        keys: path of the results of the setting in results.json
+        parameters: encoder parameters, see encode()
+    """
+    return [
+        ([f"quality_{quality}", f"chroma_{chroma}"], {"quality": quality, "chroma": chroma})
+        for quality in QUALITY_SETTINGS
+        for chroma in CHROMA_SETTINGS
+    ]
+
+
+def prepare_frame(frame: Image.Image) -> pillow_heif.HeifFile:
+    """
+    Converts a decoded frame for encode(), this is not timed.
+    """
+    return pillow_heif.from_pillow(frame)
+
+
+def encode(
+    img: pillow_heif.HeifFile,
+    output: "io.BytesIO | pathlib.Path",
+    parameters: dict,
+) -> None:
+    """
+    Encodes a frame with a setting, this is the part of the benchmark that is timed.
+
+    Args:
+        img: frame from prepare_frame()
+        output: buffer or path to write to
+        parameters: encoder parameters, see get_settings()
+    """
+    img.save(output, format="AVIF", **parameters)
+
+
 def main() -> int:
     """
     Main function.
@@ -100,6 +171,9 @@ def main() -> int:
                 MIN_TIME_MS: 0,
                 MAX_TIME_MS: 0,
                 AVG_TIME_MS: 0,
+                AVG_CPU_TIME_MS: 0,
+                AVG_CORES_USED: 0,
+                AVG_CPU_UTILIZATION: 0,
                 MIN_SIZE_B: 0,
                 MAX_SIZE_B: 0,
                 AVG_SIZE_B: 0,
@@ -114,6 +188,22 @@ def main() -> int:
         for quality in QUALITY_SETTINGS
     }
 
+    encoder_version = run_environment.get_encoder_version("AVIF")
+
+    cache = None
+    frame_hashes = []
+    if USE_ENCODE_CACHE:
+        cache = encode_cache.EncodeCache(ENCODE_CACHE_PATH, ENCODE_CACHE_MAX_SIZE_B)
+        frame_hashes = [
+            encode_cache.hash_file(pathlib.Path(INPUT_PATH, f"{frame_index}.png"))
+            for frame_index in range(FRAME_COUNT)
+        ]
+
+    fingerprint = run_environment.get_fingerprint()
+    monitor = run_environment.EnvironmentMonitor(MONITOR_INTERVAL_S)
+    monitor.start()
+    cell_results = []
+
     test_begin = time.time()
     print("Start time:", test_begin)
 
@@ -124,34 +214,69 @@ def main() -> int:
             min_time_ns = float("inf")
             max_time_ns = 0
             total_time_ns = 0
+            total_cpu_time_ns = 0
             min_size_B = float("inf")
             max_size_B = 0
             total_size_B = 0
+            cached_frame_count = 0
             min_compression_ratio = float("inf")
             max_compression_ratio = 0
             total_compression_ratio = 0
             current_result = results[f"quality_{quality}"][f"chroma_{chroma}"]
-            for frame_index in range(FRAME_COUNT):
-                img = pillow_heif.from_pillow(
-                    Image.open(pathlib.Path(INPUT_PATH, f"{frame_index}.png"))
-                )
-                buffer = io.BytesIO()
-
-                # Running encode
-                gc.disable()
-                start = time.time_ns()
-                img.save(
-                    buffer,
-                    format="AVIF",
-                    quality=quality,
-                    chroma=chroma,
-                )
-                end = time.time_ns()
-                gc.enable()
+            parameters = {"quality": quality, "chroma": chroma}
+            current_result[START_TIME_NS] = time.time_ns()
+            frames = frame_reader.FramePrefetcher(
+                INPUT_PATH,
+                range(FRAME_COUNT),
+                PREFETCH_DEPTH,
+                PREFETCH_MAX_MEMORY_B,
+            )
+            frames.start()
+            for _ in range(FRAME_COUNT):
+                frame_index, frame, io_stall_time_ns = frames.get()
+                img = prepare_frame(frame)
+
+                cache_key = None
+                cached = None
+                if cache is not None:
+                    cache_key = encode_cache.make_key(
+                        frame_hashes[frame_index],
+                        "AVIF",
+                        parameters,
+                        encoder_version,
+                    )
+                    cached = cache.get(cache_key)
+
+                if cached is not None:
+                    time_ns = cached[0]["time_ns"]
+                    cpu_time_ns = cached[0]["cpu_time_ns"]
+                    size_B = cached[0]["size_B"]
+                    cached_frame_count += 1
+                else:
+                    buffer = io.BytesIO()
+
+                    # Running encode
+                    gc.disable()
+                    start_user_ns, start_system_ns = cpu_usage.get_cpu_times_ns()
+                    start_reader_ns = frames.get_cpu_time_ns()
+                    start = time.time_ns()
+                    encode(img, buffer, parameters)
+                    end = time.time_ns()
+                    end_reader_ns = frames.get_cpu_time_ns()
+                    end_user_ns, end_system_ns = cpu_usage.get_cpu_times_ns()
+                    gc.enable()
+
+                    # Save singular test results
+                    time_ns = end - start
+                    # Exclude the frames decoded ahead in the meantime, the CPU time of the reader
+                    # is not split into user and system time so only the total is kept
+                    cpu_time_ns = (
+                        (end_user_ns - start_user_ns)
+                        + (end_system_ns - start_system_ns)
+                        - (end_reader_ns - start_reader_ns)
+                    )
+                    size_B = buffer.getbuffer().nbytes
 
-                # Save singular test results
-                time_ns = end - start
-                size_B = buffer.getbuffer().nbytes
                 original_size_B = os.path.getsize(
                     pathlib.Path(INPUT_PATH, f"{frame_index}.png"),
                 )
@@ -166,28 +291,59 @@ def main() -> int:
                 )
 
                 total_time_ns += time_ns
+                total_cpu_time_ns += cpu_time_ns
                 total_size_B += size_B
                 total_compression_ratio += compression_ratio
                 test_result = {
                     "time_ns": time_ns,
+                    "cpu_time_ns": cpu_time_ns,
+                    "io_stall_time_ns": io_stall_time_ns,
+                    "cores_used": cpu_usage.get_cores_used(cpu_time_ns, time_ns),
+                    "cpu_utilization_%": cpu_usage.get_cpu_utilization(
+                        cpu_time_ns,
+                        time_ns,
+                    ),
                     "size_B": size_B,
                     "size_ratio_compressed_to_original_%": compression_ratio,
+                    # Timing is from the run that created the cache entry
+                    "cached": cached is not None,
                 }
                 current_result[FRAME_DATA].append(test_result)
 
+                if cache is not None and cached is None:
+                    cache.put(
+                        cache_key,
+                        test_result,
+                        buffer.getvalue() if CACHE_ENCODED_BYTES else None,
+                    )
+
                 # Save one image (this one has 2 landing pads in it) for reference
                 if frame_index == FRAME_TO_SAVE:
-                    img.save(
+                    encode(
+                        img,
                         pathlib.Path(OUTPUT_PATH, f"q{quality}_c{chroma}.avif"),
-                        format="AVIF",
-                        quality=quality,
-                        chroma=chroma,
+                        parameters,
                     )
 
+            current_result[END_TIME_NS] = time.time_ns()
+            frames.stop()
+            current_result[IO_STALL_TIME_MS] = frames.stall_time_ns / 1e6
+            current_result[CACHED_FRAME_COUNT] = cached_frame_count
+            cell_results.append(current_result)
+
             # Save average test results
             current_result[MIN_TIME_MS] = min_time_ns / 1e6
             current_result[MAX_TIME_MS] = max_time_ns / 1e6
             current_result[AVG_TIME_MS] = total_time_ns / FRAME_COUNT / 1e6
+            current_result[AVG_CPU_TIME_MS] = total_cpu_time_ns / FRAME_COUNT / 1e6
+            current_result[AVG_CORES_USED] = cpu_usage.get_cores_used(
+                total_cpu_time_ns,
+                total_time_ns,
+            )
+            current_result[AVG_CPU_UTILIZATION] = cpu_usage.get_cpu_utilization(
+                total_cpu_time_ns,
+                total_time_ns,
+            )
             current_result[MIN_SIZE_B] = min_size_B
             current_result[MAX_SIZE_B] = max_size_B
             current_result[AVG_SIZE_B] = total_size_B / FRAME_COUNT
@@ -198,6 +354,21 @@ def main() -> int:
             )
             print(f"chroma {chroma} completed")
 
+    if cache is not None:
+        cache.save()
+        print(f"Encode cache hits: {cache.hits}, misses: {cache.misses}")
+
+    # Flag settings timed under contention
+    monitor.stop()
+    contended_count = 0
+    for current_result in cell_results:
+        current_result[CONTENTION] = monitor.check(
+            current_result[START_TIME_NS],
+            current_result[END_TIME_NS],
+        )
+        contended_count += int(current_result[CONTENTION][run_environment.CONTENDED])
+    print(f"{contended_count} of {len(cell_results)} settings were timed under contention")
+
     print("")
     print("-------------------TEST COMPLETED------------------")
     print("")
@@ -206,6 +377,10 @@ def main() -> int:
     with open(pathlib.Path(OUTPUT_PATH, "results.json"), "w", encoding="utf-8") as file:
         file.write(json.dumps(results, indent=2))
 
+    # Saving run environment
+    with open(pathlib.Path(OUTPUT_PATH, "environment.json"), "w", encoding="utf-8") as file:
+        file.write(json.dumps({"fingerprint": fingerprint, "samples": monitor.samples}, indent=2))
+
     # Saving shortcut results without frame data (for more human readability)
     with open(pathlib.Path(OUTPUT_PATH, "summary.csv"), "w", encoding="utf-8") as file:
         file.write(HEADER_LINE)
@@ -218,12 +393,18 @@ def main() -> int:
                     str(current_result[MIN_TIME_MS]),
                     str(current_result[MAX_TIME_MS]),
                     str(current_result[AVG_TIME_MS]),
+                    str(current_result[AVG_CPU_TIME_MS]),
+                    str(current_result[AVG_CORES_USED]),
+                    str(current_result[AVG_CPU_UTILIZATION]),
                     str(current_result[MIN_SIZE_B]),
                     str(current_result[MAX_SIZE_B]),
                     str(current_result[AVG_SIZE_B]),
                     str(current_result[MIN_SIZE_RATIO_COMPRESSED_TO_ORIGINAL]),
                     str(current_result[MAX_SIZE_RATIO_COMPRESSED_TO_ORIGINAL]),
                     str(current_result[AVG_SIZE_RATIO_COMPRESSED_TO_ORIGINAL]),
+                    str(current_result[IO_STALL_TIME_MS]),
+                    str(current_result[CACHED_FRAME_COUNT]),
+                    str(current_result[CONTENTION][run_environment.CONTENDED]),
                 ]
                 line = ",".join(line_stats) + "\n"
                 file.write(line)
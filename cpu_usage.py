@@ -0,0 +1,56 @@
+"""
+Measures the CPU time used by this process, including threads started by the encoders,
+so that the total compute of an encode can be recorded next to its wall time.
+"""
+
+import os
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+def get_cpu_times_ns() -> "tuple[int, int]":
+    """
+    Gets the CPU time used by all threads of this process so far.
+
+    Returns: (user_time_ns, system_time_ns)
+    """
+    if resource is not None:
+        # Microsecond resolution
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return int(usage.ru_utime * 1e9), int(usage.ru_stime * 1e9)
+
+    times = os.times()
+    return int(times.user * 1e9), int(times.system * 1e9)
+
+
+def get_cores_used(cpu_time_ns: int, wall_time_ns: int) -> float:
+    """
+    Average number of cores busy over a measurement.
+
+    Args:
+        cpu_time_ns: user and system time
+        wall_time_ns: wall time
+
+    Returns: number of cores used, 0 if the wall time is 0
+    """
+    if wall_time_ns <= 0:
+        return 0.0
+
+    return cpu_time_ns / wall_time_ns
+
+
+def get_cpu_utilization(cpu_time_ns: int, wall_time_ns: int) -> float:
+    """
+    Percentage of all available cores busy over a measurement.
+
+    Args:
+        cpu_time_ns: user and system time
+        wall_time_ns: wall time
+
+    Returns: CPU utilization in %
+    """
+    return 100 * get_cores_used(cpu_time_ns, wall_time_ns) / (os.cpu_count() or 1)
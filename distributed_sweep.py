@@ -0,0 +1,643 @@
+"""
+Runs the grid of codecs and settings of the benchmarks across several machines.
+
+The coordinator splits the (codec, setting, frame chunk) grid into tasks and serves them
+over HTTP. Workers pull tasks, run the same encode loop as the benchmarks
+on their own copy of the images, and push the per-frame results back.
+The settings and the encode call of each codec are taken from its benchmark module,
+so the results match those of the benchmark.
+A task that is not completed within the lease is given to another worker.
+
+Roles:
+    coordinator: serves the tasks and merges the results
+    worker: pulls and runs tasks from COORDINATOR_URL until the grid is done
+    local: coordinator and LOCAL_WORKER_COUNT worker processes on this machine (for testing,
+        the workers contend with each other so the timing is flagged as contended)
+
+The coordinator creates a folder with a .json with the merged test data (tagged with the worker
+that encoded each frame), a .json with the environment of the coordinator and each worker,
+and a .csv which provides a more human-friendly summary of the data.
+"""
+
+import gc
+import http.server
+import io
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import threading
+import time
+import urllib.request
+
+import pillow_heif
+from PIL import Image
+
+import avif_benchmark
+import cpu_usage
+import heif_benchmark
+import jpeg_benchmark
+import png_benchmark
+import run_environment
+import webp_benchmark
+
+
+# Setting parameters
+ROLE = "coordinator"  # coordinator, worker or local
+FRAME_COUNT = 300  # Total number of frames
+# Every worker needs the images at this path
+INPUT_PATH = pathlib.Path("test_images", "Encode Test Dataset 2024")
+OUTPUT_PATH = pathlib.Path("logs", str(int(time.time())))
+# Frames in each task
+FRAMES_PER_TASK = 25
+
+# Coordinator
+COORDINATOR_HOST = "0.0.0.0"  # All interfaces, so that other machines can connect
+COORDINATOR_PORT = 8765  # 0 for any free port, only useful with local workers
+# Time a worker has to complete a task before it is given to another worker
+TASK_LEASE_S = 600
+# Time to keep serving after the grid is done, so that waiting workers are told to stop
+SHUTDOWN_GRACE_S = 5
+
+# Worker
+COORDINATOR_URL = f"http://localhost:{COORDINATOR_PORT}"
+# Time between requests when all remaining tasks are leased to other workers
+POLL_INTERVAL_S = 1
+REQUEST_TIMEOUT_S = 30
+# Time to keep trying to reach the coordinator when the worker starts
+CONNECT_TIMEOUT_S = 60
+
+LOCAL_WORKER_COUNT = 4
+
+# Time between samples of CPU frequency, load and throttling
+MONITOR_INTERVAL_S = 0.5
+
+# Benchmark of each codec in the grid, see get_settings() and encode() of each module
+BENCHMARKS = {
+    "PNG": png_benchmark,
+    "JPEG": jpeg_benchmark,
+    "WEBP": webp_benchmark,
+    "HEIF": heif_benchmark,
+    "AVIF": avif_benchmark,
+}
+
+# Keys for dictionary entries
+MAX_TIME_MS = "max_time_ms"
+MIN_TIME_MS = "min_time_ms"
+AVG_TIME_MS = "avg_time_ms"
+AVG_USER_TIME_MS = "avg_user_time_ms"
+AVG_SYSTEM_TIME_MS = "avg_system_time_ms"
+AVG_CPU_TIME_MS = "avg_cpu_time_ms"
+AVG_CORES_USED = "avg_cores_used"
+AVG_CPU_UTILIZATION = "avg_cpu_utilization_%"
+MAX_SIZE_B = "max_size_B"
+MIN_SIZE_B = "min_size_B"
+AVG_SIZE_B = "avg_size_B"
+MAX_SIZE_RATIO_COMPRESSED_TO_ORIGINAL = "max_size_ratio_compressed_to_original_%"
+MIN_SIZE_RATIO_COMPRESSED_TO_ORIGINAL = "min_size_ratio_compressed_to_original_%"
+AVG_SIZE_RATIO_COMPRESSED_TO_ORIGINAL = "avg_size_ratio_compressed_to_original_%"
+FRAME_DATA = "frame_data"
+WORKERS = "workers"
+CONTENTION = "contention"
+
+# For output csv file
+HEADERS = [
+    "Codec",
+    "Setting",
+    "Min Time (ms)",
+    "Max Time (ms)",
+    "Avg Time (ms)",
+    "Avg User Time (ms)",
+    "Avg System Time (ms)",
+    "Avg CPU Time (ms)",
+    "Avg Cores Used",
+    "Avg CPU Utilization (%)",
+    "Min Size (B)",
+    "Max Size (B)",
+    "Avg Size (B)",
+    "Min Size Ratio (compressed to original in %)",
+    "Max Size Ratio (compressed to original in %)",
+    "Avg Size Ratio (compressed to original in %)",
+    "Workers",
+    "Contended",
+]
+HEADER_LINE = ",".join(HEADERS) + "\n"
+
+
+def make_tasks() -> "list[dict]":
+    """
+    Splits the grid into tasks.
+
+    Returns: tasks in the order of BENCHMARKS and their settings, each with a unique task_id
+    """
+    tasks = []
+    for codec, benchmark in BENCHMARKS.items():
+        for keys, parameters in benchmark.get_settings():
+            for first_frame_index in range(0, FRAME_COUNT, FRAMES_PER_TASK):
+                tasks.append(
+                    {
+                        "task_id": len(tasks),
+                        "codec": codec,
+                        # Path of the setting in results.json (e.g. quality_50/chroma_420)
+                        "setting_key": "/".join(keys),
+                        "parameters": parameters,
+                        "first_frame_index": first_frame_index,
+                        "frame_count": min(FRAMES_PER_TASK, FRAME_COUNT - first_frame_index),
+                    }
+                )
+
+    return tasks
+
+
+class WorkQueue:
+    """
+    Tasks leased to workers and their results. Thread safe.
+    """
+
+    def __init__(self, tasks: "list[dict]", lease_s: float) -> None:
+        """
+        tasks: see make_tasks()
+        lease_s: time a worker has to complete a task
+        """
+        self.__lock = threading.Lock()
+        self.__tasks = tasks
+        self.__lease_s = lease_s
+        # Task ID: time the lease expires (from time.time())
+        self.__leases: "dict[int, float]" = {}
+        # Task ID: result
+        self.results: "dict[int, dict]" = {}
+        # Worker ID: fingerprint
+        self.workers: "dict[str, dict]" = {}
+        self.done_event = threading.Event()
+
+    def register(self, worker_id: str, fingerprint: dict) -> None:
+        """
+        Records the environment of a worker.
+        """
+        with self.__lock:
+            self.workers[worker_id] = fingerprint
+        print(f"Worker {worker_id} registered")
+
+    def lease(self) -> "tuple[str, dict | None]":
+        """
+        Leases the next task that is neither completed nor leased to another worker.
+
+        Returns: (status, task)
+            status: task, wait (all remaining tasks are leased) or done
+            task: task if status is task, otherwise None
+        """
+        with self.__lock:
+            if len(self.results) == len(self.__tasks):
+                return "done", None
+
+            now = time.time()
+            for task in self.__tasks:
+                task_id = task["task_id"]
+                if task_id in self.results or self.__leases.get(task_id, 0) > now:
+                    continue
+
+                self.__leases[task_id] = now + self.__lease_s
+                return "task", task
+
+            return "wait", None
+
+    def complete(self, task_id: int, result: dict) -> None:
+        """
+        Records the result of a task, the first result wins if the task was leased more than once.
+        """
+        with self.__lock:
+            if task_id in self.results:
+                return
+
+            self.results[task_id] = result
+            completed_count = len(self.results)
+            if completed_count == len(self.__tasks):
+                self.done_event.set()
+
+        print(f"{completed_count} of {len(self.__tasks)} tasks completed")
+
+    def tasks(self) -> "list[dict]":
+        """
+        All tasks.
+        """
+        return self.__tasks
+
+
+class WorkQueueHandler(http.server.BaseHTTPRequestHandler):
+    """
+    JSON over HTTP POST:
+        /register {worker_id, fingerprint} -> {}
+        /task {worker_id} -> {status, task}
+        /result {worker_id, task_id, frame_data, contention} -> {}
+    """
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """
+        Handles a request from a worker.
+        """
+        work_queue: WorkQueue = self.server.work_queue
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length))
+
+        if self.path == "/register":
+            work_queue.register(request["worker_id"], request["fingerprint"])
+            response = {}
+        elif self.path == "/task":
+            status, task = work_queue.lease()
+            response = {"status": status, "task": task}
+        elif self.path == "/result":
+            work_queue.complete(
+                request["task_id"],
+                {
+                    "worker_id": request["worker_id"],
+                    FRAME_DATA: request[FRAME_DATA],
+                    CONTENTION: request[CONTENTION],
+                },
+            )
+            response = {}
+        else:
+            self.send_error(404)
+            return
+
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # pylint: disable-next=redefined-builtin
+    def log_message(self, format: str, *args: object) -> None:
+        """
+        Silences the log of every request.
+        """
+
+
+def post(url: str, request: dict) -> dict:
+    """
+    Sends a request to the coordinator.
+
+    Returns: response
+    """
+    data = json.dumps(request).encode("utf-8")
+    http_request = urllib.request.Request(
+        url,
+        data=data,
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(http_request, timeout=REQUEST_TIMEOUT_S) as response:
+        return json.loads(response.read())
+
+
+def run_task(task: dict, worker_id: str) -> "list[dict]":
+    """
+    Encodes the frames of a task, same as the encode loop of the benchmarks.
+
+    Returns: frame data
+    """
+    frame_data = []
+    for frame_index in range(
+        task["first_frame_index"],
+        task["first_frame_index"] + task["frame_count"],
+    ):
+        img = Image.open(pathlib.Path(INPUT_PATH, f"{frame_index}.png"))
+        # Decode before timing, same as the benchmarks
+        img.load()
+        if task["codec"] == "AVIF":
+            img = avif_benchmark.prepare_frame(img)
+        buffer = io.BytesIO()
+
+        # Running encode
+        gc.disable()
+        start_user_ns, start_system_ns = cpu_usage.get_cpu_times_ns()
+        start = time.time_ns()
+        BENCHMARKS[task["codec"]].encode(img, buffer, task["parameters"])
+        end = time.time_ns()
+        end_user_ns, end_system_ns = cpu_usage.get_cpu_times_ns()
+        gc.enable()
+
+        # Save singular test results
+        time_ns = end - start
+        user_time_ns = end_user_ns - start_user_ns
+        system_time_ns = end_system_ns - start_system_ns
+        size_B = buffer.getbuffer().nbytes
+        original_size_B = os.path.getsize(pathlib.Path(INPUT_PATH, f"{frame_index}.png"))
+        frame_data.append(
+            {
+                "frame_index": frame_index,
+                "worker_id": worker_id,
+                "time_ns": time_ns,
+                "user_time_ns": user_time_ns,
+                "system_time_ns": system_time_ns,
+                "cores_used": cpu_usage.get_cores_used(user_time_ns + system_time_ns, time_ns),
+                "cpu_utilization_%": cpu_usage.get_cpu_utilization(
+                    user_time_ns + system_time_ns,
+                    time_ns,
+                ),
+                "size_B": size_B,
+                "size_ratio_compressed_to_original_%": 100 * size_B / original_size_B,
+            }
+        )
+
+    return frame_data
+
+
+def run_worker(coordinator_url: str) -> int:
+    """
+    Pulls and runs tasks until the grid is done.
+
+    Returns: 0 on success, -1 if the coordinator cannot be reached
+    """
+    pillow_heif.register_heif_opener(thumbnails=False)
+    pillow_heif.register_avif_opener(thumbnails=False)
+
+    worker_id = f"{platform.node()}-{os.getpid()}"
+    fingerprint = run_environment.get_fingerprint()
+
+    # The coordinator may still be starting
+    connect_deadline = time.time() + CONNECT_TIMEOUT_S
+    while True:
+        try:
+            post(
+                f"{coordinator_url}/register",
+                {"worker_id": worker_id, "fingerprint": fingerprint},
+            )
+            break
+        except OSError as exception:
+            if time.time() > connect_deadline:
+                print(f"Worker {worker_id} cannot reach the coordinator: {exception}")
+                return -1
+            time.sleep(POLL_INTERVAL_S)
+
+    monitor = run_environment.EnvironmentMonitor(MONITOR_INTERVAL_S)
+    monitor.start()
+    task_count = 0
+    while True:
+        try:
+            response = post(f"{coordinator_url}/task", {"worker_id": worker_id})
+        except OSError:
+            # The coordinator shut down after the grid was done
+            break
+
+        if response["status"] == "done":
+            break
+
+        if response["status"] == "wait":
+            time.sleep(POLL_INTERVAL_S)
+            continue
+
+        task = response["task"]
+        start_ns = time.time_ns()
+        frame_data = run_task(task, worker_id)
+        end_ns = time.time_ns()
+        # Contention is known at the end of the next sample
+        time.sleep(MONITOR_INTERVAL_S)
+
+        try:
+            post(
+                f"{coordinator_url}/result",
+                {
+                    "worker_id": worker_id,
+                    "task_id": task["task_id"],
+                    FRAME_DATA: frame_data,
+                    CONTENTION: monitor.check(start_ns, end_ns),
+                },
+            )
+        except OSError:
+            # The coordinator shut down after another worker completed the task
+            break
+        task_count += 1
+
+    monitor.stop()
+    print(f"Worker {worker_id} completed {task_count} tasks")
+
+    return 0
+
+
+def summarize(frame_data: "list[dict]") -> dict:
+    """
+    Statistics of the frames of a setting, same as the benchmarks.
+    """
+    frame_count = len(frame_data)
+    total_time_ns = sum(frame["time_ns"] for frame in frame_data)
+    total_user_time_ns = sum(frame["user_time_ns"] for frame in frame_data)
+    total_system_time_ns = sum(frame["system_time_ns"] for frame in frame_data)
+    sizes_B = [frame["size_B"] for frame in frame_data]
+    compression_ratios = [frame["size_ratio_compressed_to_original_%"] for frame in frame_data]
+
+    return {
+        MIN_TIME_MS: min(frame["time_ns"] for frame in frame_data) / 1e6,
+        MAX_TIME_MS: max(frame["time_ns"] for frame in frame_data) / 1e6,
+        AVG_TIME_MS: total_time_ns / frame_count / 1e6,
+        AVG_USER_TIME_MS: total_user_time_ns / frame_count / 1e6,
+        AVG_SYSTEM_TIME_MS: total_system_time_ns / frame_count / 1e6,
+        AVG_CPU_TIME_MS: (total_user_time_ns + total_system_time_ns) / frame_count / 1e6,
+        AVG_CORES_USED: cpu_usage.get_cores_used(
+            total_user_time_ns + total_system_time_ns,
+            total_time_ns,
+        ),
+        AVG_CPU_UTILIZATION: cpu_usage.get_cpu_utilization(
+            total_user_time_ns + total_system_time_ns,
+            total_time_ns,
+        ),
+        MIN_SIZE_B: min(sizes_B),
+        MAX_SIZE_B: max(sizes_B),
+        AVG_SIZE_B: sum(sizes_B) / frame_count,
+        MIN_SIZE_RATIO_COMPRESSED_TO_ORIGINAL: min(compression_ratios),
+        MAX_SIZE_RATIO_COMPRESSED_TO_ORIGINAL: max(compression_ratios),
+        AVG_SIZE_RATIO_COMPRESSED_TO_ORIGINAL: sum(compression_ratios) / frame_count,
+    }
+
+
+def merge_results(work_queue: WorkQueue) -> "dict[str, dict[str, dict]]":
+    """
+    Merges the results of the tasks by setting.
+
+    Returns: codec: setting key: result of the setting
+    """
+    merged: "dict[str, dict[str, dict]]" = {codec: {} for codec in BENCHMARKS}
+    for task in work_queue.tasks():
+        task_result = work_queue.results[task["task_id"]]
+        setting_key = task["setting_key"]
+        if setting_key not in merged[task["codec"]]:
+            merged[task["codec"]][setting_key] = {
+                FRAME_DATA: [],
+                WORKERS: [],
+                CONTENTION: {
+                    run_environment.CONTENDED: False,
+                    run_environment.CONTENTION_REASONS: [],
+                },
+            }
+
+        current_result = merged[task["codec"]][setting_key]
+        current_result[FRAME_DATA] += task_result[FRAME_DATA]
+        if task_result["worker_id"] not in current_result[WORKERS]:
+            current_result[WORKERS].append(task_result["worker_id"])
+        if task_result[CONTENTION][run_environment.CONTENDED]:
+            current_result[CONTENTION][run_environment.CONTENDED] = True
+            current_result[CONTENTION][run_environment.CONTENTION_REASONS] += [
+                f"{task_result['worker_id']}: {reason}"
+                for reason in task_result[CONTENTION][run_environment.CONTENTION_REASONS]
+            ]
+
+    for settings in merged.values():
+        for current_result in settings.values():
+            current_result[FRAME_DATA].sort(key=lambda frame: frame["frame_index"])
+            current_result.update(summarize(current_result[FRAME_DATA]))
+
+    return merged
+
+
+def nest(merged: "dict[str, dict[str, dict]]") -> dict:
+    """
+    Nests the results by parameter, like the results of the benchmarks
+    (e.g. HEIF: quality_50: chroma_420).
+    """
+    results: dict = {}
+    for codec, settings in merged.items():
+        results[codec] = {}
+        for setting_key, current_result in settings.items():
+            node = results[codec]
+            parts = setting_key.split("/")
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            node[parts[-1]] = current_result
+
+    return results
+
+
+def run_coordinator(worker_count: int) -> int:
+    """
+    Serves the tasks until the grid is done, then saves the merged results.
+
+    Args:
+        worker_count: number of worker processes to start on this machine
+
+    Returns: 0 on success
+    """
+    OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
+
+    work_queue = WorkQueue(make_tasks(), TASK_LEASE_S)
+    server = http.server.ThreadingHTTPServer((COORDINATOR_HOST, COORDINATOR_PORT), WorkQueueHandler)
+    server.work_queue = work_queue
+    port = server.server_address[1]
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    test_begin = time.time()
+    print("Start time:", test_begin)
+    print(f"Serving {len(work_queue.tasks())} tasks on port {port}")
+
+    workers = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(f"http://localhost:{port}",),
+        )
+        for _ in range(worker_count)
+    ]
+    for worker in workers:
+        worker.start()
+
+    work_queue.done_event.wait()
+    time.sleep(SHUTDOWN_GRACE_S)
+    server.shutdown()
+    server.server_close()
+    for worker in workers:
+        worker.join()
+
+    merged = merge_results(work_queue)
+    contended_count = sum(
+        int(current_result[CONTENTION][run_environment.CONTENDED])
+        for settings in merged.values()
+        for current_result in settings.values()
+    )
+    setting_count = sum(len(settings) for settings in merged.values())
+    print(f"{contended_count} of {setting_count} settings were timed under contention")
+
+    print("")
+    print("-------------------TEST COMPLETED------------------")
+    print("")
+
+    # Saving full results
+    with open(pathlib.Path(OUTPUT_PATH, "results.json"), "w", encoding="utf-8") as file:
+        file.write(json.dumps(nest(merged), indent=2))
+
+    # Saving run environment
+    with open(pathlib.Path(OUTPUT_PATH, "environment.json"), "w", encoding="utf-8") as file:
+        file.write(
+            json.dumps(
+                {
+                    "fingerprint": run_environment.get_fingerprint(),
+                    "workers": work_queue.workers,
+                },
+                indent=2,
+            )
+        )
+
+    # Saving shortcut results without frame data (for more human readability)
+    with open(pathlib.Path(OUTPUT_PATH, "summary.csv"), "w", encoding="utf-8") as file:
+        file.write(HEADER_LINE)
+        for codec, settings in merged.items():
+            for setting_key, current_result in settings.items():
+                line_stats = [
+                    codec,
+                    setting_key,
+                    str(current_result[MIN_TIME_MS]),
+                    str(current_result[MAX_TIME_MS]),
+                    str(current_result[AVG_TIME_MS]),
+                    str(current_result[AVG_USER_TIME_MS]),
+                    str(current_result[AVG_SYSTEM_TIME_MS]),
+                    str(current_result[AVG_CPU_TIME_MS]),
+                    str(current_result[AVG_CORES_USED]),
+                    str(current_result[AVG_CPU_UTILIZATION]),
+                    str(current_result[MIN_SIZE_B]),
+                    str(current_result[MAX_SIZE_B]),
+                    str(current_result[AVG_SIZE_B]),
+                    str(current_result[MIN_SIZE_RATIO_COMPRESSED_TO_ORIGINAL]),
+                    str(current_result[MAX_SIZE_RATIO_COMPRESSED_TO_ORIGINAL]),
+                    str(current_result[AVG_SIZE_RATIO_COMPRESSED_TO_ORIGINAL]),
+                    # Space separated, the csv has no quoting
+                    " ".join(current_result[WORKERS]),
+                    str(current_result[CONTENTION][run_environment.CONTENDED]),
+                ]
+                line = ",".join(line_stats) + "\n"
+                file.write(line)
+
+    test_end = time.time()
+    print("End time:", test_end)
+    print(
+        "Time taken:",
+        int((test_end - test_begin) / 60),
+        "mins",
+        int(test_end - test_begin) % 60,
+        "secs",
+    )
+
+    return 0
+
+
+def main() -> int:
+    """
+    Main function.
+    """
+    if ROLE == "coordinator":
+        return run_coordinator(0)
+
+    if ROLE == "worker":
+        return run_worker(COORDINATOR_URL)
+
+    if ROLE == "local":
+        return run_coordinator(LOCAL_WORKER_COUNT)
+
+    print(f"Unknown role: {ROLE}")
+    return -1
+
+
+if __name__ == "__main__":
+    result_main = main()
+    if result_main < 0:
+        print(f"ERROR: Status code: {result_main}")
+
+    print("Done!")
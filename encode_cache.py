@@ -0,0 +1,250 @@
+"""
+On-disk cache of encode results, so that re-running a sweep over an unchanged dataset does not
+re-encode every frame at every setting.
+
+Entries are keyed by the content hash of the input frame, the codec, the encoder parameters and the
+encoder library version. Each entry stores the measured results (size, compression ratio, etc.)
+and optionally the encoded bytes. The cache is bounded in size and evicts the least recently used
+entries first.
+
+Timing results read from the cache are from the run that created the entry,
+so timing runs should bypass the cache.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+
+
+# Increase when the stored results change, so that older entries are not used
+RESULT_VERSION = 4
+
+INDEX_FILE_NAME = "index.json"
+# The index is written here first, so that a crash while saving does not corrupt it
+TEMPORARY_INDEX_FILE_NAME = "index.json.tmp"
+RESULT_SUFFIX = ".json"
+ENCODED_SUFFIX = ".bin"
+
+# Keys for index entries
+# Increases with every access, a clock can give several accesses the same time
+ACCESS_ORDER = "access_order"
+ENTRY_SIZE_B = "entry_size_B"
+
+
+def hash_file(path: pathlib.Path) -> str:
+    """
+    Hashes the contents of a file.
+
+    Args:
+        path: path to the file
+
+    Returns: SHA-256 hex digest of the file contents
+    """
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+def make_key(frame_hash: str, codec: str, parameters: dict, library_version: str) -> str:
+    """
+    Creates the cache key of an encode.
+
+    Args:
+        frame_hash: content hash of the input frame (see hash_file())
+        codec: name of the codec (e.g. "JPEG")
+        parameters: encoder parameters passed to save(), must be JSON serializable
+        library_version: version of the encoder library
+
+    Returns: cache key
+    """
+    key_data = json.dumps(
+        {
+            "frame_hash": frame_hash,
+            "codec": codec,
+            "parameters": parameters,
+            "library_version": library_version,
+            "result_version": RESULT_VERSION,
+        },
+        sort_keys=True,
+    )
+
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+
+class EncodeCache:
+    """
+    Size bounded LRU cache of encode results stored in a directory.
+    """
+
+    def __init__(self, cache_path: pathlib.Path, max_size_B: int) -> None:
+        """
+        cache_path: directory to store the cache in, created if it does not exist
+        max_size_B: maximum total size of the stored entries
+        """
+        self.__cache_path = cache_path
+        self.__max_bytes = max_size_B
+
+        self.__cache_path.mkdir(parents=True, exist_ok=True)
+
+        self.__index: "dict[str, dict[str, int]]" = {}
+        index_path = pathlib.Path(self.__cache_path, INDEX_FILE_NAME)
+        if index_path.exists():
+            try:
+                with open(index_path, "r", encoding="utf-8") as file:
+                    self.__index = {
+                        key: entry
+                        for key, entry in json.load(file).items()
+                        if ACCESS_ORDER in entry and ENTRY_SIZE_B in entry
+                    }
+            except (ValueError, AttributeError):
+                # Unreadable, the entries are recovered from the directory
+                self.__index = {}
+
+        self.__access_count = max(
+            (entry[ACCESS_ORDER] for entry in self.__index.values()),
+            default=0,
+        )
+        self.__recover()
+        self.__evict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __result_path(self, key: str) -> pathlib.Path:
+        return pathlib.Path(self.__cache_path, key + RESULT_SUFFIX)
+
+    def __encoded_path(self, key: str) -> pathlib.Path:
+        return pathlib.Path(self.__cache_path, key + ENCODED_SUFFIX)
+
+    def __recover(self) -> None:
+        """
+        Matches the index to the entries on disk, in case a previous run exited
+        without calling save().
+        """
+        # Entries deleted from disk
+        for key in list(self.__index):
+            if not self.__result_path(key).exists():
+                self.__remove(key)
+
+        # Entries written after the index was last saved, more recent than the indexed entries
+        result_paths = [
+            result_path
+            for result_path in self.__cache_path.glob("*" + RESULT_SUFFIX)
+            if result_path.stem not in self.__index and result_path.name != INDEX_FILE_NAME
+        ]
+        result_paths.sort(key=lambda result_path: result_path.stat().st_mtime_ns)
+        for result_path in result_paths:
+            key = result_path.stem
+            entry_size_B = result_path.stat().st_size
+            encoded_path = self.__encoded_path(key)
+            if encoded_path.exists():
+                entry_size_B += encoded_path.stat().st_size
+
+            self.__index[key] = {
+                ACCESS_ORDER: self.__next_access(),
+                ENTRY_SIZE_B: entry_size_B,
+            }
+
+        # Encoded bytes without results
+        for encoded_path in self.__cache_path.glob("*" + ENCODED_SUFFIX):
+            if encoded_path.stem not in self.__index:
+                encoded_path.unlink()
+
+    def __next_access(self) -> int:
+        self.__access_count += 1
+        return self.__access_count
+
+    def __remove(self, key: str) -> None:
+        self.__result_path(key).unlink(missing_ok=True)
+        self.__encoded_path(key).unlink(missing_ok=True)
+        self.__index.pop(key, None)
+
+    def get(self, key: str) -> "tuple[dict, bytes | None] | None":
+        """
+        Gets an entry and marks it as recently used.
+
+        Args:
+            key: cache key (see make_key())
+
+        Returns: (result, encoded) if the entry exists, None otherwise
+            result: stored results of the encode
+            encoded: stored encoded bytes, None if they were not stored
+        """
+        if key not in self.__index:
+            self.misses += 1
+            return None
+
+        result_path = self.__result_path(key)
+        if not result_path.exists():
+            # Entry was deleted from disk
+            self.__index.pop(key)
+            self.misses += 1
+            return None
+
+        with open(result_path, "r", encoding="utf-8") as file:
+            result = json.load(file)
+
+        encoded = None
+        encoded_path = self.__encoded_path(key)
+        if encoded_path.exists():
+            encoded = encoded_path.read_bytes()
+
+        self.__index[key][ACCESS_ORDER] = self.__next_access()
+        self.hits += 1
+
+        return result, encoded
+
+    def put(self, key: str, result: dict, encoded: "bytes | None" = None) -> None:
+        """
+        Stores an entry, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key: cache key (see make_key())
+            result: results of the encode, must be JSON serializable
+            encoded: encoded bytes, not stored if None
+        """
+        self.__remove(key)
+
+        # Results are written last, so that an entry is only recovered if it is complete
+        entry_size_B = 0
+        if encoded is not None:
+            self.__encoded_path(key).write_bytes(encoded)
+            entry_size_B += len(encoded)
+        result_data = json.dumps(result).encode("utf-8")
+        self.__result_path(key).write_bytes(result_data)
+        entry_size_B += len(result_data)
+
+        self.__index[key] = {
+            ACCESS_ORDER: self.__next_access(),
+            ENTRY_SIZE_B: entry_size_B,
+        }
+
+        self.__evict()
+
+    def __evict(self) -> None:
+        total_size_B = sum(entry[ENTRY_SIZE_B] for entry in self.__index.values())
+        if total_size_B <= self.__max_bytes:
+            return
+
+        # Least recently used first
+        keys = sorted(self.__index, key=lambda key: self.__index[key][ACCESS_ORDER])
+        for key in keys:
+            if total_size_B <= self.__max_bytes:
+                break
+
+            total_size_B -= self.__index[key][ENTRY_SIZE_B]
+            self.__remove(key)
+
+    def save(self) -> None:
+        """
+        Writes the index to disk. Must be called for the access order to persist between runs,
+        entries stored after the last call are recovered in the order they were written.
+        """
+        temporary_path = pathlib.Path(self.__cache_path, TEMPORARY_INDEX_FILE_NAME)
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write(json.dumps(self.__index, indent=2))
+        os.replace(temporary_path, pathlib.Path(self.__cache_path, INDEX_FILE_NAME))
@@ -0,0 +1,317 @@
+"""
+Predicts the encode time and size of a frame for each encoder setting before encoding,
+from cheap image features (luma entropy, gradient energy and colour variance).
+
+A linear regression per setting is fitted on the per-frame time and size data collected by
+one of the benchmarks (results.json) for the first frames of the set,
+and evaluated on the remaining frames, so that an onboard controller can choose a setting
+per frame from the predictions instead of running save().
+
+Creates a folder with a .json with the fitted models, the per-frame predictions
+and the cost of computing the features, and a .csv which summarizes the prediction error
+of each setting.
+"""
+
+import json
+import pathlib
+import time
+
+import numpy as np
+from PIL import Image
+
+import rate_control_simulator
+
+
+# Setting parameters
+# results.json of a benchmark run on the same frames
+INPUT_RESULTS_PATH = pathlib.Path("logs", "benchmark", "results.json")
+FRAME_COUNT = 300  # Total number of frames
+INPUT_PATH = pathlib.Path("test_images", "Encode Test Dataset 2024")
+OUTPUT_PATH = pathlib.Path("logs", str(int(time.time())))
+# Frames are a sequence, so the models are fitted on the first frames and tested on the rest
+TRAIN_FRAME_COUNT = 200
+# Features are computed on every FEATURE_STRIDE-th pixel in each direction
+FEATURE_STRIDE = 2
+# Regularization of the regression (on standardized features)
+RIDGE_LAMBDA = 1e-3
+# Fit the logarithm of time and size (errors are relative and predictions are positive)
+LOG_TARGETS = True
+
+FEATURE_NAMES = ["entropy_bits", "gradient_energy", "color_variance"]
+# ITU-R BT.601 luma weights out of 256
+LUMA_WEIGHTS = [77, 150, 29]
+
+# Keys for dictionary entries
+TIME_MODEL = "time_model"
+SIZE_MODEL = "size_model"
+AVG_TIME_ERROR = "avg_time_error_%"
+MAX_TIME_ERROR = "max_time_error_%"
+AVG_SIZE_ERROR = "avg_size_error_%"
+MAX_SIZE_ERROR = "max_size_error_%"
+FRAME_DATA = "frame_data"
+AVG_FEATURE_TIME_US = "avg_feature_time_us"
+MAX_FEATURE_TIME_US = "max_feature_time_us"
+AVG_PREDICTION_TIME_US = "avg_prediction_time_us"
+SETTINGS = "settings"
+
+# For output csv file
+HEADERS = [
+    "Setting",
+    "Avg Time Error (%)",
+    "Max Time Error (%)",
+    "Avg Size Error (%)",
+    "Max Size Error (%)",
+]
+HEADER_LINE = ",".join(HEADERS) + "\n"
+
+
+def compute_features(pixels: np.ndarray) -> np.ndarray:
+    """
+    Computes the features of a frame.
+
+    Args:
+        pixels: frame as an array (height, width) or (height, width, channels) of uint8
+
+    Returns: features in the order of FEATURE_NAMES
+    """
+    pixels = pixels[::FEATURE_STRIDE, ::FEATURE_STRIDE]
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, np.newaxis]
+    # Ignore alpha
+    pixels = pixels[:, :, :3]
+
+    if pixels.shape[2] == 3:
+        luma = (
+            pixels[:, :, 0].astype(np.uint16) * LUMA_WEIGHTS[0]
+            + pixels[:, :, 1].astype(np.uint16) * LUMA_WEIGHTS[1]
+            + pixels[:, :, 2].astype(np.uint16) * LUMA_WEIGHTS[2]
+        ) >> 8
+    else:
+        luma = pixels[:, :, 0].astype(np.uint16)
+
+    histogram = np.bincount(luma.ravel(), minlength=256)
+    probabilities = histogram[histogram > 0] / luma.size
+    entropy_bits = -np.sum(probabilities * np.log2(probabilities))
+
+    luma = luma.astype(np.int16)
+    gradient_energy = np.abs(np.diff(luma, axis=1)).mean() + np.abs(np.diff(luma, axis=0)).mean()
+
+    color_variance = pixels.reshape(-1, pixels.shape[2]).var(axis=0).mean()
+
+    return np.array([entropy_bits, gradient_energy, color_variance])
+
+
+class LinearModel:
+    """
+    Ridge regression on standardized features.
+    """
+
+    def __init__(self, ridge_lambda: float, log_target: bool) -> None:
+        """
+        ridge_lambda: regularization, the intercept is not regularized
+        log_target: fit the logarithm of the target
+        """
+        self.ridge_lambda = ridge_lambda
+        self.log_target = log_target
+        self.mean = np.zeros(0)
+        self.scale = np.zeros(0)
+        self.weights = np.zeros(0)
+
+    def fit(self, features: np.ndarray, targets: np.ndarray) -> None:
+        """
+        Fits the model.
+
+        Args:
+            features: (sample count, feature count)
+            targets: (sample count,), must be positive if log_target
+        """
+        self.mean = features.mean(axis=0)
+        self.scale = features.std(axis=0)
+        # Constant feature
+        self.scale[self.scale == 0] = 1
+
+        design = np.hstack([np.ones((features.shape[0], 1)), (features - self.mean) / self.scale])
+        if self.log_target:
+            targets = np.log(targets)
+
+        regularization = self.ridge_lambda * np.eye(design.shape[1])
+        regularization[0, 0] = 0
+        self.weights = np.linalg.solve(design.T @ design + regularization, design.T @ targets)
+
+    def predict(self, features: np.ndarray) -> "float | np.ndarray":
+        """
+        Predicts the target.
+
+        Args:
+            features: (feature count,) or (sample count, feature count)
+
+        Returns: prediction, or array of predictions (sample count,)
+        """
+        prediction = self.weights[0] + ((features - self.mean) / self.scale) @ self.weights[1:]
+        if self.log_target:
+            prediction = np.exp(prediction)
+
+        return prediction
+
+    def to_dict(self) -> dict:
+        """
+        Returns: JSON serializable model, see from_dict()
+        """
+        return {
+            "ridge_lambda": self.ridge_lambda,
+            "log_target": self.log_target,
+            "feature_names": FEATURE_NAMES,
+            "mean": self.mean.tolist(),
+            "scale": self.scale.tolist(),
+            "weights": self.weights.tolist(),
+        }
+
+    @staticmethod
+    def from_dict(model: dict) -> "LinearModel":
+        """
+        Loads a model saved with to_dict().
+        """
+        linear_model = LinearModel(model["ridge_lambda"], model["log_target"])
+        linear_model.mean = np.array(model["mean"])
+        linear_model.scale = np.array(model["scale"])
+        linear_model.weights = np.array(model["weights"])
+
+        return linear_model
+
+
+def get_errors(predictions: np.ndarray, targets: np.ndarray) -> "tuple[float, float]":
+    """
+    Absolute error of the predictions relative to the targets.
+
+    Returns: (average_%, maximum_%)
+    """
+    errors = 100 * np.abs(predictions - targets) / targets
+
+    return float(errors.mean()), float(errors.max())
+
+
+def main() -> int:
+    """
+    Main function.
+    """
+    if not INPUT_RESULTS_PATH.exists():
+        print(f"Benchmark results not found: {INPUT_RESULTS_PATH}")
+        return -1
+
+    if not 0 < TRAIN_FRAME_COUNT < FRAME_COUNT:
+        print(f"Train frame count must be between 0 and {FRAME_COUNT}: {TRAIN_FRAME_COUNT}")
+        return -1
+
+    with open(INPUT_RESULTS_PATH, "r", encoding="utf-8") as file:
+        settings = rate_control_simulator.load_settings(json.load(file))
+
+    # Only settings with one entry per frame (not e.g. per batch of frames)
+    settings = [setting for setting in settings if len(setting.frame_data) == FRAME_COUNT]
+    if len(settings) == 0:
+        print(f"No settings with data for {FRAME_COUNT} frames in: {INPUT_RESULTS_PATH}")
+        return -1
+
+    OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
+
+    # Computing features
+    features = np.zeros((FRAME_COUNT, len(FEATURE_NAMES)))
+    feature_times_ns = np.zeros(FRAME_COUNT)
+    for frame_index in range(FRAME_COUNT):
+        img = Image.open(pathlib.Path(INPUT_PATH, f"{frame_index}.png"))
+        # Decoding is not part of the cost, onboard the frame is already in memory
+        img.load()
+
+        start = time.time_ns()
+        features[frame_index] = compute_features(np.asarray(img))
+        end = time.time_ns()
+        feature_times_ns[frame_index] = end - start
+
+    results = {
+        AVG_FEATURE_TIME_US: float(feature_times_ns.mean() / 1e3),
+        MAX_FEATURE_TIME_US: float(feature_times_ns.max() / 1e3),
+        AVG_PREDICTION_TIME_US: 0,
+        SETTINGS: {},
+    }
+    print(f"Features take {results[AVG_FEATURE_TIME_US]:.1f} us per frame")
+
+    train = slice(0, TRAIN_FRAME_COUNT)
+    test = slice(TRAIN_FRAME_COUNT, FRAME_COUNT)
+    models = []
+    for setting in settings:
+        times_ms = np.array([frame["time_ns"] / 1e6 for frame in setting.frame_data])
+        sizes_B = np.array([frame["size_B"] for frame in setting.frame_data], dtype=np.float64)
+
+        time_model = LinearModel(RIDGE_LAMBDA, LOG_TARGETS)
+        time_model.fit(features[train], times_ms[train])
+        size_model = LinearModel(RIDGE_LAMBDA, LOG_TARGETS)
+        size_model.fit(features[train], sizes_B[train])
+        models.append((time_model, size_model))
+
+        predicted_times_ms = time_model.predict(features[test])
+        predicted_sizes_B = size_model.predict(features[test])
+        avg_time_error, max_time_error = get_errors(predicted_times_ms, times_ms[test])
+        avg_size_error, max_size_error = get_errors(predicted_sizes_B, sizes_B[test])
+
+        results[SETTINGS][setting.name] = {
+            TIME_MODEL: time_model.to_dict(),
+            SIZE_MODEL: size_model.to_dict(),
+            AVG_TIME_ERROR: avg_time_error,
+            MAX_TIME_ERROR: max_time_error,
+            AVG_SIZE_ERROR: avg_size_error,
+            MAX_SIZE_ERROR: max_size_error,
+            FRAME_DATA: [
+                {
+                    "frame_index": frame_index,
+                    "time_ms": times_ms[frame_index],
+                    "predicted_time_ms": predicted_times_ms[i],
+                    "size_B": sizes_B[frame_index],
+                    "predicted_size_B": predicted_sizes_B[i],
+                }
+                for i, frame_index in enumerate(range(TRAIN_FRAME_COUNT, FRAME_COUNT))
+            ],
+        }
+        print(
+            f"{setting.name}: time error {avg_time_error:.1f}% avg, {max_time_error:.1f}% max, "
+            f"size error {avg_size_error:.1f}% avg, {max_size_error:.1f}% max"
+        )
+
+    # Cost of predicting every setting for one frame, as a controller would
+    start = time.time_ns()
+    for frame_index in range(TRAIN_FRAME_COUNT, FRAME_COUNT):
+        for time_model, size_model in models:
+            time_model.predict(features[frame_index])
+            size_model.predict(features[frame_index])
+    end = time.time_ns()
+    results[AVG_PREDICTION_TIME_US] = (end - start) / (FRAME_COUNT - TRAIN_FRAME_COUNT) / 1e3
+    print(
+        f"Predicting {len(models)} settings takes {results[AVG_PREDICTION_TIME_US]:.1f} us "
+        "per frame"
+    )
+
+    # Saving full results
+    with open(pathlib.Path(OUTPUT_PATH, "results.json"), "w", encoding="utf-8") as file:
+        file.write(json.dumps(results, indent=2))
+
+    # Saving shortcut results without frame data (for more human readability)
+    with open(pathlib.Path(OUTPUT_PATH, "summary.csv"), "w", encoding="utf-8") as file:
+        file.write(HEADER_LINE)
+        for name, current_result in results[SETTINGS].items():
+            line_stats = [
+                name,
+                str(current_result[AVG_TIME_ERROR]),
+                str(current_result[MAX_TIME_ERROR]),
+                str(current_result[AVG_SIZE_ERROR]),
+                str(current_result[MAX_SIZE_ERROR]),
+            ]
+            line = ",".join(line_stats) + "\n"
+            file.write(line)
+
+    return 0
+
+
+if __name__ == "__main__":
+    result_main = main()
+    if result_main < 0:
+        print(f"ERROR: Status code: {result_main}")
+
+    print("Done!")
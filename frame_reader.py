@@ -0,0 +1,168 @@
+"""
+Reads and decodes the frames of a dataset in a background thread, ahead of the encode loop,
+into a buffer bounded by frame count and decoded size, so that datasets too large
+to load at once can be streamed without disk reads and decoding inflating encode timings.
+
+The time the encode loop waits for a frame (I/O stall) is reported separately.
+"""
+
+import collections
+import pathlib
+import threading
+import time
+
+from PIL import Image
+
+
+def get_decoded_size(image: Image.Image) -> int:
+    """
+    Approximate memory used by a decoded image in bytes.
+    """
+    return image.width * image.height * len(image.getbands())
+
+
+# pylint: disable-next=too-many-instance-attributes
+class FramePrefetcher:
+    """
+    Decodes frames in order in a background thread, up to depth frames and max_memory_B
+    decoded bytes ahead of the consumer (at least one frame is always buffered).
+    A depth of 0 decodes each frame synchronously in get().
+    """
+
+    def __init__(
+        self,
+        input_path: pathlib.Path,
+        frame_indices: "range | list[int]",
+        depth: int,
+        max_memory_B: int,
+    ) -> None:
+        """
+        input_path: folder with the frames named <frame index>.png
+        frame_indices: frames to read, in the order they are consumed
+        depth: maximum number of buffered frames
+        max_memory_B: maximum decoded size of the buffered frames
+        """
+        self.__input_path = input_path
+        self.__frame_indices = frame_indices
+        self.__depth = depth
+        self.__max_bytes = max_memory_B
+
+        self.__condition = threading.Condition()
+        # (frame index, image, decoded size)
+        self.__buffer: "collections.deque[tuple[int, Image.Image, int]]" = collections.deque()
+        self.__buffered_bytes = 0
+        self.__error: "Exception | None" = None
+        self.__is_stopping = False
+        self.__next_position = 0
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__last_cpu_time_ns = 0
+
+        self.stall_time_ns = 0
+
+    def start(self) -> None:
+        """
+        Starts reading ahead.
+        """
+        if self.__depth > 0:
+            self.__thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops reading ahead and releases the buffered frames.
+        """
+        with self.__condition:
+            self.__is_stopping = True
+            self.__buffer.clear()
+            self.__buffered_bytes = 0
+            self.__condition.notify_all()
+
+        if self.__thread.is_alive():
+            self.__thread.join()
+
+    def __load(self, frame_index: int) -> Image.Image:
+        image = Image.open(pathlib.Path(self.__input_path, f"{frame_index}.png"))
+        image.load()
+        return image
+
+    def __run(self) -> None:
+        for frame_index in self.__frame_indices:
+            try:
+                image = self.__load(frame_index)
+            # Any error must reach get(), otherwise it waits forever
+            # pylint: disable-next=broad-exception-caught
+            except Exception as exception:
+                with self.__condition:
+                    self.__error = exception
+                    self.__condition.notify_all()
+                return
+
+            size_B = get_decoded_size(image)
+            with self.__condition:
+                while (
+                    not self.__is_stopping
+                    and len(self.__buffer) > 0
+                    and (
+                        len(self.__buffer) >= self.__depth
+                        or self.__buffered_bytes + size_B > self.__max_bytes
+                    )
+                ):
+                    self.__condition.wait()
+
+                if self.__is_stopping:
+                    return
+
+                self.__buffer.append((frame_index, image, size_B))
+                self.__buffered_bytes += size_B
+                self.__condition.notify_all()
+
+    def get(self) -> "tuple[int, Image.Image, int]":
+        """
+        Waits for the next frame.
+
+        Returns: (frame_index, image, stall_time_ns)
+            frame_index: index of the frame
+            image: decoded frame
+            stall_time_ns: time spent waiting for the frame
+        """
+        if self.__next_position >= len(self.__frame_indices):
+            raise IndexError("All frames have been read")
+
+        start = time.time_ns()
+        if self.__depth == 0:
+            frame_index = self.__frame_indices[self.__next_position]
+            image = self.__load(frame_index)
+        else:
+            with self.__condition:
+                while len(self.__buffer) == 0 and self.__error is None:
+                    self.__condition.wait()
+
+                if len(self.__buffer) == 0:
+                    raise self.__error
+
+                frame_index, image, size_B = self.__buffer.popleft()
+                self.__buffered_bytes -= size_B
+                self.__condition.notify_all()
+        end = time.time_ns()
+
+        self.__next_position += 1
+        stall_time_ns = end - start
+        self.stall_time_ns += stall_time_ns
+
+        return frame_index, image, stall_time_ns
+
+    def get_cpu_time_ns(self) -> int:
+        """
+        CPU time used by the background thread so far, so that it can be excluded
+        from the CPU time of an encode. 0 if it cannot be measured on this platform.
+        """
+        if not self.__thread.is_alive() or not hasattr(time, "pthread_getcpuclockid"):
+            return self.__last_cpu_time_ns
+
+        try:
+            clock_id = time.pthread_getcpuclockid(self.__thread.ident)
+            self.__last_cpu_time_ns = time.clock_gettime_ns(clock_id)
+        except OSError:
+            # Thread exited
+            pass
+
+        return self.__last_cpu_time_ns
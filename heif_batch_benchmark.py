@@ -0,0 +1,446 @@
+"""
+Benchmarks HEIF or AVIF compression of batches of consecutive frames into one multi-image container
+on a given set of images (300 landing pad images captured from a flight test).
+
+The encoder is set up once per container, so the header and encoder setup costs are shared
+by all frames in the batch. Reports the amortized time and size per frame for each batch size,
+as well as the latency added by waiting for the rest of the batch.
+
+Creates a folder with a container for each setting to visually check the quality,
+as well as a .json with the test data and a .csv which provides a more human-friendly summary
+of the data.
+"""
+
+import gc
+import hashlib
+import io
+import json
+import os
+import pathlib
+import time
+
+import pillow_heif
+from PIL import Image
+
+import cpu_usage
+import encode_cache
+import run_environment
+
+
+# Setting parameters
+FRAME_COUNT = 300  # Total number of frames
+FRAME_TO_SAVE = 69  # This frame is good, it has both landing pads in it
+INPUT_PATH = pathlib.Path("test_images", "Encode Test Dataset 2024")
+OUTPUT_PATH = pathlib.Path("logs", str(int(time.time())))
+FORMAT = "HEIF"  # HEIF or AVIF
+FRAME_RATE_HZ = 10  # Rate frames are captured at, to calculate the latency added by batching
+
+QUALITY_SETTINGS = [30, 50, 70, 90]
+CHROMA = 420
+# Number of consecutive frames in each container, 1 is the same as the single image benchmarks
+BATCH_SIZES = [1, 2, 5, 10, 30]
+
+# Encode cache, results of a cache hit include the timing of the run that created the entry
+# so the cache must be disabled for timing runs
+USE_ENCODE_CACHE = False
+CACHE_ENCODED_BYTES = False
+ENCODE_CACHE_PATH = pathlib.Path("logs", "encode_cache")
+ENCODE_CACHE_MAX_SIZE_B = 1 << 30  # 1 GiB
+
+# Time between samples of CPU frequency, load and throttling
+MONITOR_INTERVAL_S = 0.5
+
+# Keys for dictionary entries
+# Time and size are per frame (amortized over the batch)
+MAX_TIME_MS = "max_time_ms"
+MIN_TIME_MS = "min_time_ms"
+AVG_TIME_MS = "avg_time_ms"
+AVG_BATCH_TIME_MS = "avg_batch_time_ms"
+ADDED_LATENCY_MS = "added_latency_ms"
+AVG_USER_TIME_MS = "avg_user_time_ms"
+AVG_SYSTEM_TIME_MS = "avg_system_time_ms"
+AVG_CPU_TIME_MS = "avg_cpu_time_ms"
+AVG_CORES_USED = "avg_cores_used"
+AVG_CPU_UTILIZATION = "avg_cpu_utilization_%"
+MAX_SIZE_B = "max_size_B"
+MIN_SIZE_B = "min_size_B"
+AVG_SIZE_B = "avg_size_B"
+MAX_SIZE_RATIO_COMPRESSED_TO_ORIGINAL = "max_size_ratio_compressed_to_original_%"
+MIN_SIZE_RATIO_COMPRESSED_TO_ORIGINAL = "min_size_ratio_compressed_to_original_%"
+AVG_SIZE_RATIO_COMPRESSED_TO_ORIGINAL = "avg_size_ratio_compressed_to_original_%"
+FRAME_DATA = "frame_data"
+START_TIME_NS = "start_time_ns"
+END_TIME_NS = "end_time_ns"
+CONTENTION = "contention"
+CACHED_BATCH_COUNT = "cached_batch_count"
+
+# For output csv file
+HEADERS = [
+    "Quality",
+    "Batch Size",
+    "Min Time per Frame (ms)",
+    "Max Time per Frame (ms)",
+    "Avg Time per Frame (ms)",
+    "Avg Batch Time (ms)",
+    "Added Latency (ms)",
+    "Avg User Time per Frame (ms)",
+    "Avg System Time per Frame (ms)",
+    "Avg CPU Time per Frame (ms)",
+    "Avg Cores Used",
+    "Avg CPU Utilization (%)",
+    "Min Size per Frame (B)",
+    "Max Size per Frame (B)",
+    "Avg Size per Frame (B)",
+    "Min Size Ratio (compressed to original in %)",
+    "Max Size Ratio (compressed to original in %)",
+    "Avg Size Ratio (compressed to original in %)",
+    "Cached Batches",
+    "Contended",
+]
+HEADER_LINE = ",".join(HEADERS) + "\n"
+
+
+def update_min_max(
+    min_value: "int | float",
+    max_value: "int | float",
+    current_value: "int | float",
+) -> "tuple[int, int] | tuple[float, float]":
+    """
+    Updates the min and max values for a measurement.
+
+    Args:
+        min_value: previous minimum value
+        max_value: previous maximum value
+        current_value: currently measured value
+
+    Returns: (min_value, max_value)
+        min_value: new updated minimum recorded value
+        max_value: new updated maximum recorded value
+
+        The intended output is something like [int, int] or [float, float],
+        but it is not guaranteed because the inputs could be a combination of int and float.
+        eg. could also be tuple[float, int]
+    """
+    if current_value < min_value:
+        min_value = current_value
+    if current_value > max_value:
+        max_value = current_value
+
+    return min_value, max_value
+
+
+def main() -> int:
+    """
+    Main function.
+    """
+    if FORMAT == "AVIF":
+        pillow_heif.register_avif_opener(thumbnails=False)
+    else:
+        pillow_heif.register_heif_opener(thumbnails=False)
+
+    OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
+
+    results = {
+        f"quality_{quality}": {
+            f"batch_size_{batch_size}": {
+                MIN_TIME_MS: 0,
+                MAX_TIME_MS: 0,
+                AVG_TIME_MS: 0,
+                AVG_BATCH_TIME_MS: 0,
+                ADDED_LATENCY_MS: 0,
+                AVG_USER_TIME_MS: 0,
+                AVG_SYSTEM_TIME_MS: 0,
+                AVG_CPU_TIME_MS: 0,
+                AVG_CORES_USED: 0,
+                AVG_CPU_UTILIZATION: 0,
+                MIN_SIZE_B: 0,
+                MAX_SIZE_B: 0,
+                AVG_SIZE_B: 0,
+                # % of original size
+                MIN_SIZE_RATIO_COMPRESSED_TO_ORIGINAL: 0,
+                MAX_SIZE_RATIO_COMPRESSED_TO_ORIGINAL: 0,
+                AVG_SIZE_RATIO_COMPRESSED_TO_ORIGINAL: 0,
+                # One entry per batch
+                FRAME_DATA: [],
+            }
+            for batch_size in BATCH_SIZES
+        }
+        for quality in QUALITY_SETTINGS
+    }
+
+    encoder_version = run_environment.get_encoder_version(FORMAT)
+
+    cache = None
+    frame_hashes = []
+    if USE_ENCODE_CACHE:
+        cache = encode_cache.EncodeCache(ENCODE_CACHE_PATH, ENCODE_CACHE_MAX_SIZE_B)
+        frame_hashes = [
+            encode_cache.hash_file(pathlib.Path(INPUT_PATH, f"{frame_index}.png"))
+            for frame_index in range(FRAME_COUNT)
+        ]
+
+    fingerprint = run_environment.get_fingerprint()
+    monitor = run_environment.EnvironmentMonitor(MONITOR_INTERVAL_S)
+    monitor.start()
+    cell_results = []
+
+    test_begin = time.time()
+    print("Start time:", test_begin)
+
+    for quality in QUALITY_SETTINGS:
+        print(f"-----------------QUALITY = {quality}--------------------")
+        for batch_size in BATCH_SIZES:
+            min_time_ns = float("inf")
+            max_time_ns = 0
+            total_time_ns = 0
+            total_user_time_ns = 0
+            total_system_time_ns = 0
+            min_size_B = float("inf")
+            max_size_B = 0
+            total_size_B = 0
+            min_compression_ratio = float("inf")
+            max_compression_ratio = 0
+            total_compression_ratio = 0
+            batch_count = 0
+            cached_batch_count = 0
+            current_result = results[f"quality_{quality}"][f"batch_size_{batch_size}"]
+            current_result[START_TIME_NS] = time.time_ns()
+            for first_frame_index in range(0, FRAME_COUNT, batch_size):
+                frame_indices = range(
+                    first_frame_index,
+                    min(first_frame_index + batch_size, FRAME_COUNT),
+                )
+                # Decode before timing so that only the encode is measured
+                images = []
+                for frame_index in frame_indices:
+                    image = Image.open(pathlib.Path(INPUT_PATH, f"{frame_index}.png"))
+                    image.load()
+                    images.append(image)
+
+                cache_key = None
+                cached = None
+                if cache is not None:
+                    batch_hash = hashlib.sha256(
+                        "".join(frame_hashes[frame_index] for frame_index in frame_indices).encode(
+                            "utf-8"
+                        )
+                    ).hexdigest()
+                    cache_key = encode_cache.make_key(
+                        batch_hash,
+                        f"{FORMAT}_batch",
+                        {"quality": quality, "chroma": CHROMA},
+                        encoder_version,
+                    )
+                    cached = cache.get(cache_key)
+
+                if cached is not None:
+                    time_ns = cached[0]["time_ns"]
+                    user_time_ns = cached[0]["user_time_ns"]
+                    system_time_ns = cached[0]["system_time_ns"]
+                    size_B = cached[0]["size_B"]
+                    cached_batch_count += 1
+                else:
+                    buffer = io.BytesIO()
+
+                    # Running encode of all frames of the batch into one container
+                    gc.disable()
+                    start_user_ns, start_system_ns = cpu_usage.get_cpu_times_ns()
+                    start = time.time_ns()
+                    images[0].save(
+                        buffer,
+                        format=FORMAT,
+                        save_all=True,
+                        append_images=images[1:],
+                        quality=quality,
+                        chroma=CHROMA,
+                    )
+                    end = time.time_ns()
+                    end_user_ns, end_system_ns = cpu_usage.get_cpu_times_ns()
+                    gc.enable()
+
+                    # Save singular test results
+                    time_ns = end - start
+                    user_time_ns = end_user_ns - start_user_ns
+                    system_time_ns = end_system_ns - start_system_ns
+                    size_B = buffer.getbuffer().nbytes
+
+                original_size_B = sum(
+                    os.path.getsize(pathlib.Path(INPUT_PATH, f"{frame_index}.png"))
+                    for frame_index in frame_indices
+                )
+                compression_ratio = 100 * size_B / original_size_B
+
+                # Amortized over the frames in the batch
+                time_per_frame_ns = time_ns / len(frame_indices)
+                size_per_frame_B = size_B / len(frame_indices)
+
+                min_time_ns, max_time_ns = update_min_max(
+                    min_time_ns,
+                    max_time_ns,
+                    time_per_frame_ns,
+                )
+                min_size_B, max_size_B = update_min_max(min_size_B, max_size_B, size_per_frame_B)
+                min_compression_ratio, max_compression_ratio = update_min_max(
+                    min_compression_ratio,
+                    max_compression_ratio,
+                    compression_ratio,
+                )
+
+                total_time_ns += time_ns
+                total_user_time_ns += user_time_ns
+                total_system_time_ns += system_time_ns
+                total_size_B += size_B
+                total_compression_ratio += compression_ratio
+                batch_count += 1
+                test_result = {
+                    "first_frame_index": first_frame_index,
+                    "frame_count": len(frame_indices),
+                    "time_ns": time_ns,
+                    "time_per_frame_ns": time_per_frame_ns,
+                    "user_time_ns": user_time_ns,
+                    "system_time_ns": system_time_ns,
+                    "cores_used": cpu_usage.get_cores_used(user_time_ns + system_time_ns, time_ns),
+                    "cpu_utilization_%": cpu_usage.get_cpu_utilization(
+                        user_time_ns + system_time_ns,
+                        time_ns,
+                    ),
+                    "size_B": size_B,
+                    "size_per_frame_B": size_per_frame_B,
+                    "size_ratio_compressed_to_original_%": compression_ratio,
+                    # Timing is from the run that created the cache entry
+                    "cached": cached is not None,
+                }
+                current_result[FRAME_DATA].append(test_result)
+
+                if cache is not None and cached is None:
+                    cache.put(
+                        cache_key,
+                        test_result,
+                        buffer.getvalue() if CACHE_ENCODED_BYTES else None,
+                    )
+
+                # Save the batch with this frame (it has 2 landing pads in it) for reference
+                if FRAME_TO_SAVE in frame_indices:
+                    images[0].save(
+                        pathlib.Path(
+                            OUTPUT_PATH,
+                            f"q{quality}_b{batch_size}.{FORMAT.lower()}",
+                        ),
+                        format=FORMAT,
+                        save_all=True,
+                        append_images=images[1:],
+                        quality=quality,
+                        chroma=CHROMA,
+                    )
+
+            current_result[END_TIME_NS] = time.time_ns()
+            current_result[CACHED_BATCH_COUNT] = cached_batch_count
+            cell_results.append(current_result)
+
+            # Save average test results
+            current_result[MIN_TIME_MS] = min_time_ns / 1e6
+            current_result[MAX_TIME_MS] = max_time_ns / 1e6
+            current_result[AVG_TIME_MS] = total_time_ns / FRAME_COUNT / 1e6
+            current_result[AVG_BATCH_TIME_MS] = total_time_ns / batch_count / 1e6
+            # The first frame of the batch waits for the rest of the frames to be captured
+            current_result[ADDED_LATENCY_MS] = (batch_size - 1) / FRAME_RATE_HZ * 1e3
+            current_result[AVG_USER_TIME_MS] = total_user_time_ns / FRAME_COUNT / 1e6
+            current_result[AVG_SYSTEM_TIME_MS] = total_system_time_ns / FRAME_COUNT / 1e6
+            current_result[AVG_CPU_TIME_MS] = (
+                (total_user_time_ns + total_system_time_ns) / FRAME_COUNT / 1e6
+            )
+            current_result[AVG_CORES_USED] = cpu_usage.get_cores_used(
+                total_user_time_ns + total_system_time_ns,
+                total_time_ns,
+            )
+            current_result[AVG_CPU_UTILIZATION] = cpu_usage.get_cpu_utilization(
+                total_user_time_ns + total_system_time_ns,
+                total_time_ns,
+            )
+            current_result[MIN_SIZE_B] = min_size_B
+            current_result[MAX_SIZE_B] = max_size_B
+            current_result[AVG_SIZE_B] = total_size_B / FRAME_COUNT
+            current_result[MIN_SIZE_RATIO_COMPRESSED_TO_ORIGINAL] = min_compression_ratio
+            current_result[MAX_SIZE_RATIO_COMPRESSED_TO_ORIGINAL] = max_compression_ratio
+            current_result[AVG_SIZE_RATIO_COMPRESSED_TO_ORIGINAL] = (
+                total_compression_ratio / batch_count
+            )
+            print(f"Batch size {batch_size} complete")
+
+    if cache is not None:
+        cache.save()
+        print(f"Encode cache hits: {cache.hits}, misses: {cache.misses}")
+
+    # Flag settings timed under contention
+    monitor.stop()
+    contended_count = 0
+    for current_result in cell_results:
+        current_result[CONTENTION] = monitor.check(
+            current_result[START_TIME_NS],
+            current_result[END_TIME_NS],
+        )
+        contended_count += int(current_result[CONTENTION][run_environment.CONTENDED])
+    print(f"{contended_count} of {len(cell_results)} settings were timed under contention")
+
+    print("")
+    print("-------------------TEST COMPLETED------------------")
+    print("")
+
+    # Saving full results
+    with open(pathlib.Path(OUTPUT_PATH, "results.json"), "w", encoding="utf-8") as file:
+        file.write(json.dumps(results, indent=2))
+
+    # Saving run environment
+    with open(pathlib.Path(OUTPUT_PATH, "environment.json"), "w", encoding="utf-8") as file:
+        file.write(json.dumps({"fingerprint": fingerprint, "samples": monitor.samples}, indent=2))
+
+    # Saving shortcut results without frame data (for more human readability)
+    with open(pathlib.Path(OUTPUT_PATH, "summary.csv"), "w", encoding="utf-8") as file:
+        file.write(HEADER_LINE)
+        for quality in QUALITY_SETTINGS:
+            for batch_size in BATCH_SIZES:
+                current_result = results[f"quality_{quality}"][f"batch_size_{batch_size}"]
+                line_stats = [
+                    str(quality),
+                    str(batch_size),
+                    str(current_result[MIN_TIME_MS]),
+                    str(current_result[MAX_TIME_MS]),
+                    str(current_result[AVG_TIME_MS]),
+                    str(current_result[AVG_BATCH_TIME_MS]),
+                    str(current_result[ADDED_LATENCY_MS]),
+                    str(current_result[AVG_USER_TIME_MS]),
+                    str(current_result[AVG_SYSTEM_TIME_MS]),
+                    str(current_result[AVG_CPU_TIME_MS]),
+                    str(current_result[AVG_CORES_USED]),
+                    str(current_result[AVG_CPU_UTILIZATION]),
+                    str(current_result[MIN_SIZE_B]),
+                    str(current_result[MAX_SIZE_B]),
+                    str(current_result[AVG_SIZE_B]),
+                    str(current_result[MIN_SIZE_RATIO_COMPRESSED_TO_ORIGINAL]),
+                    str(current_result[MAX_SIZE_RATIO_COMPRESSED_TO_ORIGINAL]),
+                    str(current_result[AVG_SIZE_RATIO_COMPRESSED_TO_ORIGINAL]),
+                    str(current_result[CACHED_BATCH_COUNT]),
+                    str(current_result[CONTENTION][run_environment.CONTENDED]),
+                ]
+                line = ",".join(line_stats) + "\n"
+                file.write(line)
+
+    test_end = time.time()
+    print("End time:", test_end)
+    print(
+        "Time taken:",
+        int((test_end - test_begin) / 60),
+        "mins",
+        int(test_end - test_begin) % 60,
+        "secs",
+    )
+
+    return 0
+
+
+if __name__ == "__main__":
+    result_main = main()
+    if result_main < 0:
+        print(f"ERROR: Status code: {result_main}")
+
+    print("Done!")
@@ -0,0 +1,261 @@
+"""
+PNG encoder that filters and deflates the image in independent chunks of rows in parallel
+(like pigz), so that high compression levels are usable at flight latency.
+
+Each chunk is compressed as raw deflate ending on a sync flush (byte aligned, not final),
+primed with the last 32 KiB of the previous chunk as its dictionary so that the compression ratio
+is close to a single stream. The chunks are concatenated into one zlib stream
+whose Adler-32 is combined from the Adler-32 of each chunk.
+The result is a standard PNG with one IDAT chunk, or one IDAT chunk per compressed chunk.
+"""
+
+import concurrent.futures
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Bytes (excluding the filter type byte) that the deflate window can refer back to
+WINDOW_SIZE_B = 32768
+ADLER32_BASE = 65521
+# zlib memory level, same as Pillow's PNG encoder
+MEMORY_LEVEL = 9
+# Uncompressed size of each chunk, same as the pigz default
+CHUNK_SIZE_B = 128 * 1024
+
+# Mode: (colour type, channels), all 8 bits per channel
+COLOUR_TYPES = {
+    "L": (0, 1),
+    "RGB": (2, 3),
+    "LA": (4, 2),
+    "RGBA": (6, 4),
+}
+
+
+def adler32_combine(adler1: int, adler2: int, length2: int) -> int:
+    """
+    Combines the Adler-32 of two consecutive pieces of data (same as zlib's adler32_combine()).
+
+    Args:
+        adler1: Adler-32 of the first piece
+        adler2: Adler-32 of the second piece
+        length2: length of the second piece
+
+    Returns: Adler-32 of both pieces concatenated
+    """
+    remainder = length2 % ADLER32_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (remainder * sum1) % ADLER32_BASE
+    sum1 += (adler2 & 0xFFFF) + ADLER32_BASE - 1
+    sum2 += (adler1 >> 16) + (adler2 >> 16) + ADLER32_BASE - remainder
+    sum1 %= ADLER32_BASE
+    sum2 %= ADLER32_BASE
+
+    return sum1 | (sum2 << 16)
+
+
+def filter_rows(rows: np.ndarray, previous_row: np.ndarray, channels: int) -> bytes:
+    """
+    Applies adaptive PNG filtering: for each row, the filter with the minimum sum of absolute
+    (signed) differences is used (same heuristic as libpng).
+
+    Args:
+        rows: rows of pixels (height, width * channels)
+        previous_row: row above the first row, zeros for the first row of the image
+        channels: bytes per pixel
+
+    Returns: filtered rows, each preceded by its filter type
+    """
+    current = rows.astype(np.int16)
+    up = np.vstack([previous_row[np.newaxis, :], rows[:-1]]).astype(np.int16)
+    left = np.zeros_like(current)
+    left[:, channels:] = current[:, :-channels]
+    up_left = np.zeros_like(current)
+    up_left[:, channels:] = up[:, :-channels]
+
+    # Paeth predictor
+    initial = left + up - up_left
+    distance_left = np.abs(initial - left)
+    distance_up = np.abs(initial - up)
+    distance_up_left = np.abs(initial - up_left)
+    paeth = np.where(
+        (distance_left <= distance_up) & (distance_left <= distance_up_left),
+        left,
+        np.where(distance_up <= distance_up_left, up, up_left),
+    )
+
+    filtered = np.stack(
+        [
+            current,
+            current - left,
+            current - up,
+            current - ((left + up) >> 1),
+            current - paeth,
+        ]
+    ).astype(np.uint8)
+
+    # Sum of absolute values as signed bytes
+    costs = np.abs(filtered.view(np.int8).astype(np.int32)).sum(axis=2)
+    filter_types = np.argmin(costs, axis=0)
+
+    output = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+    output[:, 0] = filter_types
+    output[:, 1:] = filtered[filter_types, np.arange(rows.shape[0])]
+
+    return output.tobytes()
+
+
+def compress_chunk(
+    rows: np.ndarray,
+    previous_row: np.ndarray,
+    dictionary_row_count: int,
+    channels: int,
+    compress_level: int,
+    compress_type: int,
+    is_last: bool,
+) -> "tuple[bytes, int, int]":
+    """
+    Filters and compresses one chunk of rows. Runs in a worker.
+
+    Args:
+        rows: rows before the chunk used for the dictionary, followed by the rows of the chunk
+        previous_row: row above the first row, zeros for the first row of the image
+        dictionary_row_count: number of rows before the chunk
+        channels: bytes per pixel
+        compress_level: zlib compression level
+        compress_type: zlib strategy (same as Pillow's compress_type)
+        is_last: whether this is the last chunk of the image
+
+    Returns: (compressed, adler32, length)
+        compressed: raw deflate data of the chunk
+        adler32: Adler-32 of the uncompressed chunk
+        length: length of the uncompressed chunk
+    """
+    filtered = filter_rows(rows, previous_row, channels)
+    split = dictionary_row_count * (rows.shape[1] + 1)
+    dictionary = filtered[max(split - WINDOW_SIZE_B, 0) : split]
+    data = filtered[split:]
+
+    if len(dictionary) > 0:
+        compressor = zlib.compressobj(
+            compress_level,
+            zlib.DEFLATED,
+            -zlib.MAX_WBITS,
+            MEMORY_LEVEL,
+            compress_type,
+            dictionary,
+        )
+    else:
+        compressor = zlib.compressobj(
+            compress_level,
+            zlib.DEFLATED,
+            -zlib.MAX_WBITS,
+            MEMORY_LEVEL,
+            compress_type,
+        )
+
+    compressed = compressor.compress(data)
+    compressed += compressor.flush(zlib.Z_FINISH if is_last else zlib.Z_SYNC_FLUSH)
+
+    return compressed, zlib.adler32(data), len(data)
+
+
+def _chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + chunk_type
+        + data
+        + struct.pack(">I", zlib.crc32(chunk_type + data))
+    )
+
+
+def _zlib_header(compress_level: int) -> bytes:
+    # Deflate with a 32 KiB window
+    cmf = 0x78
+    if compress_level < 2:
+        compression_level_flag = 0
+    elif compress_level < 6:
+        compression_level_flag = 1
+    elif compress_level == 6:
+        compression_level_flag = 2
+    else:
+        compression_level_flag = 3
+
+    flg = compression_level_flag << 6
+    flg += 31 - ((cmf << 8) + flg) % 31
+
+    return bytes([cmf, flg])
+
+
+def encode(
+    image: Image.Image,
+    compress_level: int,
+    compress_type: int,
+    executor: concurrent.futures.Executor,
+    chunk_size_B: int = CHUNK_SIZE_B,
+    multiple_idat: bool = False,
+) -> bytes:
+    """
+    Encodes an image as PNG, compressing chunks of rows in parallel.
+
+    Args:
+        image: image in mode L, LA, RGB or RGBA
+        compress_level: zlib compression level (1-9)
+        compress_type: zlib strategy (same as Pillow's compress_type)
+        executor: thread or process pool to compress the chunks in
+        chunk_size_B: approximate uncompressed size of each chunk
+        multiple_idat: write one IDAT chunk per compressed chunk instead of a single IDAT chunk
+
+    Returns: PNG file contents
+    """
+    if image.mode not in COLOUR_TYPES:
+        raise ValueError(f"Unsupported mode: {image.mode}")
+
+    colour_type, channels = COLOUR_TYPES[image.mode]
+    width, height = image.size
+    pixels = np.asarray(image).reshape(height, width * channels)
+
+    rows_per_chunk = max(chunk_size_B // (width * channels + 1), 1)
+    dictionary_row_count = -(-WINDOW_SIZE_B // (width * channels + 1))
+    zero_row = np.zeros(width * channels, dtype=np.uint8)
+
+    futures = []
+    for start in range(0, height, rows_per_chunk):
+        end = min(start + rows_per_chunk, height)
+        rows_start = max(start - dictionary_row_count, 0)
+        previous_row = pixels[rows_start - 1] if rows_start > 0 else zero_row
+        futures.append(
+            executor.submit(
+                compress_chunk,
+                pixels[rows_start:end],
+                previous_row,
+                start - rows_start,
+                channels,
+                compress_level,
+                compress_type,
+                end == height,
+            )
+        )
+
+    compressed_chunks = []
+    adler32 = 1
+    for future in futures:
+        compressed, chunk_adler32, length = future.result()
+        compressed_chunks.append(compressed)
+        adler32 = adler32_combine(adler32, chunk_adler32, length)
+    compressed_chunks[0] = _zlib_header(compress_level) + compressed_chunks[0]
+    compressed_chunks[-1] += struct.pack(">I", adler32)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, colour_type, 0, 0, 0)
+    png = PNG_SIGNATURE + _chunk(b"IHDR", header)
+    if multiple_idat:
+        for compressed in compressed_chunks:
+            png += _chunk(b"IDAT", compressed)
+    else:
+        png += _chunk(b"IDAT", b"".join(compressed_chunks))
+    png += _chunk(b"IEND", b"")
+
+    return png
@@ -0,0 +1,469 @@
+"""
+Benchmarks the parallel PNG encoder (parallel_png.py) against Pillow's PNG encoder:
+compression time and size (the ratio of the compressed image to the original image)
+on a given set of images (300 landing pad images captured from a flight test).
+
+Creates a folder with a compressed image for each quality setting to visually check the quality,
+as well as a .json with the test data and a .csv which provides a more human-friendly summary
+of the data.
+"""
+
+import concurrent.futures
+import gc
+import io
+import itertools
+import json
+import os
+import pathlib
+import time
+
+import cpu_usage
+import encode_cache
+import frame_reader
+import parallel_png
+import run_environment
+
+
+# Setting parameters
+FRAME_COUNT = 300  # Total number of frames
+FRAME_TO_SAVE = 69  # This frame is good, it has both landing pads in it
+INPUT_PATH = pathlib.Path("test_images", "Encode Test Dataset 2024")
+OUTPUT_PATH = pathlib.Path("logs", str(int(time.time())))
+COMPRESS_TYPES = [0, 1, 2, 3, 4]  # There are 5 different compression algorithms, each are numbered
+# Compress level 0 is skipped because it is uncompressed
+COMPRESS_LEVELS = [1, 2, 3, 4, 5, 6, 7, 8, 9]
+# pillow is Pillow's single threaded encoder, parallel is parallel_png.py
+ENCODERS = ["pillow", "parallel"]
+WORKER_COUNT = os.cpu_count()
+# Processes avoid the GIL for the filtering but the rows are copied to the workers,
+# and the CPU time of the workers is not measured (CPU columns of the parallel encoder are None)
+USE_PROCESS_POOL = False
+CHUNK_SIZE_B = parallel_png.CHUNK_SIZE_B
+MULTIPLE_IDAT = False
+
+# Encode cache, results of a cache hit include the timing of the run that created the entry
+# so the cache must be disabled for timing runs
+USE_ENCODE_CACHE = False
+CACHE_ENCODED_BYTES = False
+ENCODE_CACHE_PATH = pathlib.Path("logs", "encode_cache")
+ENCODE_CACHE_MAX_SIZE_B = 1 << 30  # 1 GiB
+
+# Time between samples of CPU frequency, load and throttling
+MONITOR_INTERVAL_S = 0.5
+
+# Frames are decoded ahead of the encode loop in a background thread
+PREFETCH_DEPTH = 8  # 0 decodes each frame synchronously
+PREFETCH_MAX_MEMORY_B = 512 << 20  # 512 MiB
+
+# Keys for dictionary entries
+MAX_TIME_MS = "max_time_ms"
+MIN_TIME_MS = "min_time_ms"
+AVG_TIME_MS = "avg_time_ms"
+AVG_CPU_TIME_MS = "avg_cpu_time_ms"
+AVG_CORES_USED = "avg_cores_used"
+AVG_CPU_UTILIZATION = "avg_cpu_utilization_%"
+MAX_SIZE_B = "max_size_B"
+MIN_SIZE_B = "min_size_B"
+AVG_SIZE_B = "avg_size_B"
+MAX_SIZE_RATIO_COMPRESSED_TO_ORIGINAL = "max_size_ratio_compressed_to_original_%"
+MIN_SIZE_RATIO_COMPRESSED_TO_ORIGINAL = "min_size_ratio_compressed_to_original_%"
+AVG_SIZE_RATIO_COMPRESSED_TO_ORIGINAL = "avg_size_ratio_compressed_to_original_%"
+FRAME_DATA = "frame_data"
+START_TIME_NS = "start_time_ns"
+END_TIME_NS = "end_time_ns"
+CONTENTION = "contention"
+IO_STALL_TIME_MS = "io_stall_time_ms"
+CACHED_FRAME_COUNT = "cached_frame_count"
+
+# For output csv file
+HEADERS = [
+    "Compression Type",
+    "Compression Level",
+    "Encoder",
+    "Min Time (ms)",
+    "Max Time (ms)",
+    "Avg Time (ms)",
+    "Avg CPU Time (ms)",
+    "Avg Cores Used",
+    "Avg CPU Utilization (%)",
+    "Min Size (B)",
+    "Max Size (B)",
+    "Avg Size (B)",
+    "Min Size Ratio (compressed to original in %)",
+    "Max Size Ratio (compressed to original in %)",
+    "Avg Size Ratio (compressed to original in %)",
+    "IO Stall Time (ms)",
+    "Cached Frames",
+    "Contended",
+]
+HEADER_LINE = ",".join(HEADERS) + "\n"
+
+
+def update_min_max(
+    min_value: "int | float",
+    max_value: "int | float",
+    current_value: "int | float",
+) -> "tuple[int, int] | tuple[float, float]":
+    """
+    Updates the min and max values for a measurement.
+
+    Args:
+        min_value: previous minimum value
+        max_value: previous maximum value
+        current_value: currently measured value
+
+    Returns: (min_value, max_value)
+        min_value: new updated minimum recorded value
+        max_value: new updated maximum recorded value
+
+        The intended output is something like [int, int] or [float, float],
+        but it is not guaranteed because the inputs could be a combination of int and float.
+        eg. could also be tuple[float, int]
+    """
+    if current_value < min_value:
+        min_value = current_value
+    if current_value > max_value:
+        max_value = current_value
+
+    return min_value, max_value
+
+
+def main() -> int:
+    """
+    Main function.
+    """
+    OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
+
+    results = {
+        f"compress_type_{compress_type}": {
+            f"compress_level_{compress_level}": {
+                f"encoder_{encoder}": {
+                    MIN_TIME_MS: 0,
+                    MAX_TIME_MS: 0,
+                    AVG_TIME_MS: 0,
+                    AVG_CPU_TIME_MS: 0,
+                    AVG_CORES_USED: 0,
+                    AVG_CPU_UTILIZATION: 0,
+                    MIN_SIZE_B: 0,
+                    MAX_SIZE_B: 0,
+                    AVG_SIZE_B: 0,
+                    # % of original size
+                    MIN_SIZE_RATIO_COMPRESSED_TO_ORIGINAL: 0,
+                    MAX_SIZE_RATIO_COMPRESSED_TO_ORIGINAL: 0,
+                    AVG_SIZE_RATIO_COMPRESSED_TO_ORIGINAL: 0,
+                    FRAME_DATA: [],
+                }
+                for encoder in ENCODERS
+            }
+            for compress_level in COMPRESS_LEVELS
+        }
+        for compress_type in COMPRESS_TYPES
+    }
+
+    encoder_versions = {
+        "pillow": run_environment.get_encoder_version("PNG"),
+        "parallel": run_environment.get_encoder_version("PNG_parallel"),
+    }
+
+    cache = None
+    frame_hashes = []
+    if USE_ENCODE_CACHE:
+        cache = encode_cache.EncodeCache(ENCODE_CACHE_PATH, ENCODE_CACHE_MAX_SIZE_B)
+        frame_hashes = [
+            encode_cache.hash_file(pathlib.Path(INPUT_PATH, f"{frame_index}.png"))
+            for frame_index in range(FRAME_COUNT)
+        ]
+
+    fingerprint = run_environment.get_fingerprint()
+    monitor = run_environment.EnvironmentMonitor(MONITOR_INTERVAL_S)
+    monitor.start()
+    cell_results = []
+
+    if USE_PROCESS_POOL:
+        executor = concurrent.futures.ProcessPoolExecutor(WORKER_COUNT)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(WORKER_COUNT)
+
+    test_begin = time.time()
+    print("Start time:", test_begin)
+
+    for compress_type in COMPRESS_TYPES:
+        print(f"-----------------COMPRESS TYPE {compress_type}--------------------")
+        for compress_level, encoder in itertools.product(COMPRESS_LEVELS, ENCODERS):
+            min_time_ns = float("inf")
+            max_time_ns = 0
+            total_time_ns = 0
+            total_cpu_time_ns = 0
+            min_size_B = float("inf")
+            max_size_B = 0
+            total_size_B = 0
+            cached_frame_count = 0
+            min_compression_ratio = float("inf")
+            max_compression_ratio = 0
+            total_compression_ratio = 0
+            current_result = results[f"compress_type_{compress_type}"][
+                f"compress_level_{compress_level}"
+            ][f"encoder_{encoder}"]
+            # The CPU time of worker processes is not included in the CPU time of this process
+            is_cpu_time_counted = not (USE_PROCESS_POOL and encoder == "parallel")
+            current_result[START_TIME_NS] = time.time_ns()
+            frames = frame_reader.FramePrefetcher(
+                INPUT_PATH,
+                range(FRAME_COUNT),
+                PREFETCH_DEPTH,
+                PREFETCH_MAX_MEMORY_B,
+            )
+            frames.start()
+            for _ in range(FRAME_COUNT):
+                frame_index, img, io_stall_time_ns = frames.get()
+
+                cache_key = None
+                cached = None
+                if cache is not None:
+                    cache_key = encode_cache.make_key(
+                        frame_hashes[frame_index],
+                        f"PNG_{encoder}",
+                        {
+                            "compress_level": compress_level,
+                            "compress_type": compress_type,
+                            "chunk_size_B": CHUNK_SIZE_B,
+                            "multiple_idat": MULTIPLE_IDAT,
+                            "use_process_pool": USE_PROCESS_POOL,
+                        },
+                        encoder_versions[encoder],
+                    )
+                    cached = cache.get(cache_key)
+
+                if cached is not None:
+                    time_ns = cached[0]["time_ns"]
+                    cpu_time_ns = cached[0]["cpu_time_ns"]
+                    size_B = cached[0]["size_B"]
+                    cached_frame_count += 1
+                else:
+                    buffer = io.BytesIO()
+
+                    # Running encode
+                    gc.disable()
+                    start_user_ns, start_system_ns = cpu_usage.get_cpu_times_ns()
+                    start_reader_ns = frames.get_cpu_time_ns()
+                    start = time.time_ns()
+                    if encoder == "parallel":
+                        buffer.write(
+                            parallel_png.encode(
+                                img,
+                                compress_level,
+                                compress_type,
+                                executor,
+                                CHUNK_SIZE_B,
+                                MULTIPLE_IDAT,
+                            )
+                        )
+                    else:
+                        img.save(
+                            buffer,
+                            format="PNG",
+                            compress_level=compress_level,
+                            compress_type=compress_type,
+                        )
+                    end = time.time_ns()
+                    end_reader_ns = frames.get_cpu_time_ns()
+                    end_user_ns, end_system_ns = cpu_usage.get_cpu_times_ns()
+                    gc.enable()
+
+                    # Save singular test results
+                    time_ns = end - start
+                    # Exclude the frames decoded ahead in the meantime, the CPU time of the reader
+                    # is not split into user and system time so only the total is kept
+                    cpu_time_ns = (
+                        (end_user_ns - start_user_ns)
+                        + (end_system_ns - start_system_ns)
+                        - (end_reader_ns - start_reader_ns)
+                    )
+                    size_B = buffer.getbuffer().nbytes
+
+                if not is_cpu_time_counted:
+                    cpu_time_ns = None
+
+                original_size_B = os.path.getsize(
+                    pathlib.Path(INPUT_PATH, f"{frame_index}.png"),
+                )
+                compression_ratio = 100 * size_B / original_size_B
+
+                min_time_ns, max_time_ns = update_min_max(min_time_ns, max_time_ns, time_ns)
+                min_size_B, max_size_B = update_min_max(min_size_B, max_size_B, size_B)
+                min_compression_ratio, max_compression_ratio = update_min_max(
+                    min_compression_ratio,
+                    max_compression_ratio,
+                    compression_ratio,
+                )
+
+                total_time_ns += time_ns
+                total_size_B += size_B
+                total_compression_ratio += compression_ratio
+                cores_used = None
+                cpu_utilization = None
+                if cpu_time_ns is not None:
+                    total_cpu_time_ns += cpu_time_ns
+                    cores_used = cpu_usage.get_cores_used(cpu_time_ns, time_ns)
+                    cpu_utilization = cpu_usage.get_cpu_utilization(
+                        cpu_time_ns,
+                        time_ns,
+                    )
+                test_result = {
+                    "time_ns": time_ns,
+                    "cpu_time_ns": cpu_time_ns,
+                    "io_stall_time_ns": io_stall_time_ns,
+                    "cores_used": cores_used,
+                    "cpu_utilization_%": cpu_utilization,
+                    "size_B": size_B,
+                    "size_ratio_compressed_to_original_%": compression_ratio,
+                    # Timing is from the run that created the cache entry
+                    "cached": cached is not None,
+                }
+                current_result[FRAME_DATA].append(test_result)
+
+                if cache is not None and cached is None:
+                    cache.put(
+                        cache_key,
+                        test_result,
+                        buffer.getvalue() if CACHE_ENCODED_BYTES else None,
+                    )
+
+                # Save one image (this one has 2 landing pads in it) for reference
+                if frame_index == FRAME_TO_SAVE:
+                    reference_path = pathlib.Path(
+                        OUTPUT_PATH,
+                        f"ct{compress_type}_cl{compress_level}_{encoder}.png",
+                    )
+                    if encoder == "parallel":
+                        reference_path.write_bytes(
+                            parallel_png.encode(
+                                img,
+                                compress_level,
+                                compress_type,
+                                executor,
+                                CHUNK_SIZE_B,
+                                MULTIPLE_IDAT,
+                            )
+                        )
+                    else:
+                        img.save(
+                            reference_path,
+                            format="PNG",
+                            compress_level=compress_level,
+                            compress_type=compress_type,
+                        )
+
+            current_result[END_TIME_NS] = time.time_ns()
+            frames.stop()
+            current_result[IO_STALL_TIME_MS] = frames.stall_time_ns / 1e6
+            current_result[CACHED_FRAME_COUNT] = cached_frame_count
+            cell_results.append(current_result)
+
+            # Save average test results
+            current_result[MIN_TIME_MS] = min_time_ns / 1e6
+            current_result[MAX_TIME_MS] = max_time_ns / 1e6
+            current_result[AVG_TIME_MS] = total_time_ns / FRAME_COUNT / 1e6
+            if is_cpu_time_counted:
+                current_result[AVG_CPU_TIME_MS] = total_cpu_time_ns / FRAME_COUNT / 1e6
+                current_result[AVG_CORES_USED] = cpu_usage.get_cores_used(
+                    total_cpu_time_ns,
+                    total_time_ns,
+                )
+                current_result[AVG_CPU_UTILIZATION] = cpu_usage.get_cpu_utilization(
+                    total_cpu_time_ns,
+                    total_time_ns,
+                )
+            else:
+                current_result[AVG_CPU_TIME_MS] = None
+                current_result[AVG_CORES_USED] = None
+                current_result[AVG_CPU_UTILIZATION] = None
+            current_result[MIN_SIZE_B] = min_size_B
+            current_result[MAX_SIZE_B] = max_size_B
+            current_result[AVG_SIZE_B] = total_size_B / FRAME_COUNT
+            current_result[MIN_SIZE_RATIO_COMPRESSED_TO_ORIGINAL] = min_compression_ratio
+            current_result[MAX_SIZE_RATIO_COMPRESSED_TO_ORIGINAL] = max_compression_ratio
+            current_result[AVG_SIZE_RATIO_COMPRESSED_TO_ORIGINAL] = (
+                total_compression_ratio / FRAME_COUNT
+            )
+            print(f"Compress level {compress_level} {encoder} complete")
+
+    if cache is not None:
+        cache.save()
+        print(f"Encode cache hits: {cache.hits}, misses: {cache.misses}")
+
+    executor.shutdown()
+
+    # Flag settings timed under contention
+    monitor.stop()
+    contended_count = 0
+    for current_result in cell_results:
+        current_result[CONTENTION] = monitor.check(
+            current_result[START_TIME_NS],
+            current_result[END_TIME_NS],
+        )
+        contended_count += int(current_result[CONTENTION][run_environment.CONTENDED])
+    print(f"{contended_count} of {len(cell_results)} settings were timed under contention")
+
+    print("")
+    print("-------------------TEST COMPLETED------------------")
+    print("")
+
+    # Saving full results
+    with open(pathlib.Path(OUTPUT_PATH, "results.json"), "w", encoding="utf-8") as file:
+        file.write(json.dumps(results, indent=2))
+
+    # Saving run environment
+    with open(pathlib.Path(OUTPUT_PATH, "environment.json"), "w", encoding="utf-8") as file:
+        file.write(json.dumps({"fingerprint": fingerprint, "samples": monitor.samples}, indent=2))
+
+    # Saving shortcut results without frame data (for more human readability)
+    with open(pathlib.Path(OUTPUT_PATH, "summary.csv"), "w", encoding="utf-8") as file:
+        file.write(HEADER_LINE)
+        for compress_type in COMPRESS_TYPES:
+            for compress_level, encoder in itertools.product(COMPRESS_LEVELS, ENCODERS):
+                current_result = results[f"compress_type_{compress_type}"][
+                    f"compress_level_{compress_level}"
+                ][f"encoder_{encoder}"]
+                line_stats = [
+                    str(compress_type),
+                    str(compress_level),
+                    encoder,
+                    str(current_result[MIN_TIME_MS]),
+                    str(current_result[MAX_TIME_MS]),
+                    str(current_result[AVG_TIME_MS]),
+                    str(current_result[AVG_CPU_TIME_MS]),
+                    str(current_result[AVG_CORES_USED]),
+                    str(current_result[AVG_CPU_UTILIZATION]),
+                    str(current_result[MIN_SIZE_B]),
+                    str(current_result[MAX_SIZE_B]),
+                    str(current_result[AVG_SIZE_B]),
+                    str(current_result[MIN_SIZE_RATIO_COMPRESSED_TO_ORIGINAL]),
+                    str(current_result[MAX_SIZE_RATIO_COMPRESSED_TO_ORIGINAL]),
+                    str(current_result[AVG_SIZE_RATIO_COMPRESSED_TO_ORIGINAL]),
+                    str(current_result[IO_STALL_TIME_MS]),
+                    str(current_result[CACHED_FRAME_COUNT]),
+                    str(current_result[CONTENTION][run_environment.CONTENDED]),
+                ]
+                line = ",".join(line_stats) + "\n"
+                file.write(line)
+
+    test_end = time.time()
+    print("End time:", test_end)
+    print(
+        "Time taken:",
+        int((test_end - test_begin) / 60),
+        "mins",
+        int(test_end - test_begin) % 60,
+        "secs",
+    )
+
+    return 0
+
+
+if __name__ == "__main__":
+    result_main = main()
+    if result_main < 0:
+        print(f"ERROR: Status code: {result_main}")
+
+    print("Done!")
@@ -0,0 +1,481 @@
+"""
+Simulates adaptive rate control over a downlink using the per-frame time and size data
+collected by one of the benchmarks (results.json), without re-encoding.
+
+Each frame is captured at a fixed frame rate, encoded with the setting chosen by the rate control
+policy (taking the encode time and size measured by the benchmark for that frame and setting),
+and then sent over a link whose bandwidth follows a trace (constant or from a .csv).
+A frame that is not fully received within the latency target after capture is a deadline miss.
+
+Creates a folder with a .json with the per-frame simulation data of each policy
+and a .csv which summarizes deadline misses, average quality and link utilization.
+"""
+
+import bisect
+import csv
+import json
+import pathlib
+import re
+import time
+
+
+# Setting parameters
+# results.json of a benchmark run
+INPUT_RESULTS_PATH = pathlib.Path("logs", "benchmark", "results.json")
+OUTPUT_PATH = pathlib.Path("logs", str(int(time.time())))
+FRAME_RATE_HZ = 10
+LATENCY_TARGET_S = 0.5
+# Bandwidth trace .csv with the columns time_s,bandwidth_Bps (bandwidth starting at that time)
+# If None, the link has a constant bandwidth
+BANDWIDTH_TRACE_PATH = None
+CONSTANT_BANDWIDTH_BPS = 250_000
+# Fraction of the bandwidth the adaptive policies aim to use, leaving room for variation
+TARGET_LINK_UTILIZATION = 0.8
+# Settings without a quality in their name (e.g. PNG) are lossless
+LOSSLESS_QUALITY = 100
+# Gains of the PID on size policy, error is relative to the target size per frame
+PID_KP = 4.0
+PID_KI = 0.5
+PID_KD = 1.0
+
+# Keys for dictionary entries
+FRAME_DATA = "frame_data"
+DEADLINE_MISSES = "deadline_misses"
+DEADLINE_MISS_RATE = "deadline_miss_rate_%"
+AVG_QUALITY = "avg_quality"
+AVG_LATENCY_MS = "avg_latency_ms"
+MAX_LATENCY_MS = "max_latency_ms"
+LINK_UTILIZATION = "link_utilization_%"
+AVG_SIZE_B = "avg_size_B"
+
+# For output csv file
+HEADERS = [
+    "Policy",
+    "Deadline Misses",
+    "Deadline Miss Rate (%)",
+    "Avg Quality",
+    "Avg Latency (ms)",
+    "Max Latency (ms)",
+    "Link Utilization (%)",
+    "Avg Size (B)",
+]
+HEADER_LINE = ",".join(HEADERS) + "\n"
+
+
+class Setting:
+    """
+    Encoder setting and its per-frame data from the benchmark.
+    """
+
+    def __init__(self, name: str, quality: float, frame_data: "list[dict]") -> None:
+        """
+        name: path of the setting in results.json (e.g. quality_50/chroma_420)
+        quality: quality of the setting, higher is better
+        frame_data: per-frame results of the setting
+        """
+        self.name = name
+        self.quality = quality
+        self.frame_data = frame_data
+        self.avg_size_B = sum(frame["size_B"] for frame in frame_data) / len(frame_data)
+        self.avg_time_s = sum(frame["time_ns"] for frame in frame_data) / len(frame_data) / 1e9
+
+
+def load_settings(results: dict) -> "list[Setting]":
+    """
+    Flattens the (possibly nested) results of a benchmark into a list of settings.
+
+    Args:
+        results: contents of results.json
+
+    Returns: settings sorted by quality, then by average size (descending)
+    """
+    settings = []
+
+    def visit(node: dict, path: "list[str]") -> None:
+        if FRAME_DATA in node:
+            name = "/".join(path)
+            match = re.search(r"(?:quality|lossy)_(-?\d+)", name)
+            quality = float(match.group(1)) if match else LOSSLESS_QUALITY
+            settings.append(Setting(name, quality, node[FRAME_DATA]))
+            return
+
+        for key, child in node.items():
+            if isinstance(child, dict):
+                visit(child, path + [key])
+
+    visit(results, [])
+    settings.sort(key=lambda setting: (setting.quality, -setting.avg_size_B))
+
+    return settings
+
+
+def load_bandwidth_trace() -> "list[tuple[float, float]]":
+    """
+    Loads the bandwidth trace.
+
+    Returns: list of (time_s, bandwidth_Bps) sorted by time, the first starting at 0
+    """
+    if BANDWIDTH_TRACE_PATH is None:
+        return [(0.0, float(CONSTANT_BANDWIDTH_BPS))]
+
+    trace = []
+    with open(BANDWIDTH_TRACE_PATH, "r", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            trace.append((float(row["time_s"]), float(row["bandwidth_Bps"])))
+
+    trace.sort()
+    if len(trace) == 0 or trace[0][0] > 0:
+        # Link is down until the first entry
+        trace.insert(0, (0.0, 0.0))
+
+    return trace
+
+
+class Link:
+    """
+    Sends frames one at a time over a link with a bandwidth trace.
+    """
+
+    def __init__(self, trace: "list[tuple[float, float]]") -> None:
+        """
+        trace: see load_bandwidth_trace()
+        """
+        self.__times_s = [entry[0] for entry in trace]
+        self.__bandwidths = [entry[1] for entry in trace]
+        self.free_s = 0.0
+
+    def bandwidth_Bps(self, time_s: float) -> float:
+        """
+        Bandwidth at the given time.
+        """
+        index = bisect.bisect_right(self.__times_s, time_s) - 1
+        return self.__bandwidths[max(index, 0)]
+
+    def capacity_B(self, start_s: float, end_s: float) -> float:
+        """
+        Number of bytes the link can send between the given times.
+        """
+        capacity_B = 0.0
+        index = max(bisect.bisect_right(self.__times_s, start_s) - 1, 0)
+        current_s = start_s
+        while current_s < end_s:
+            segment_end_s = end_s
+            if index + 1 < len(self.__times_s):
+                segment_end_s = min(end_s, self.__times_s[index + 1])
+            capacity_B += (segment_end_s - current_s) * self.__bandwidths[index]
+            current_s = segment_end_s
+            index += 1
+
+        return capacity_B
+
+    def send(self, ready_s: float, size_B: int) -> float:
+        """
+        Sends a frame once both the frame and the link are ready.
+
+        Args:
+            ready_s: time the frame is encoded
+            size_B: size of the frame
+
+        Returns: time the frame is fully received, infinity if the link never sends it
+        """
+        index = max(bisect.bisect_right(self.__times_s, max(ready_s, self.free_s)) - 1, 0)
+        current_s = max(ready_s, self.free_s)
+        remaining_B = float(size_B)
+        while remaining_B > 0:
+            bandwidth_Bps = self.__bandwidths[index]
+            segment_end_s = float("inf")
+            if index + 1 < len(self.__times_s):
+                segment_end_s = self.__times_s[index + 1]
+
+            if bandwidth_Bps > 0 and current_s + remaining_B / bandwidth_Bps <= segment_end_s:
+                current_s += remaining_B / bandwidth_Bps
+                remaining_B = 0
+            elif segment_end_s == float("inf"):
+                # Link is down for the rest of the trace
+                current_s = float("inf")
+                break
+            else:
+                remaining_B -= (segment_end_s - current_s) * bandwidth_Bps
+                current_s = segment_end_s
+                index += 1
+
+        self.free_s = current_s
+        return current_s
+
+
+class FixedPolicy:
+    """
+    Always uses the same setting.
+    """
+
+    def __init__(self, setting_index: int) -> None:
+        self.__setting_index = setting_index
+
+    def select(  # pylint: disable=unused-argument
+        self,
+        capture_s: float,
+        encoder_free_s: float,
+        link: Link,
+        settings: "list[Setting]",
+    ) -> int:
+        """
+        Chooses the setting of the next frame.
+
+        Args:
+            capture_s: capture time of the frame
+            encoder_free_s: time the encoder finishes the previous frames
+            link: link state, only the past may be used
+            settings: available settings sorted by quality
+
+        Returns: index of the setting in settings
+        """
+        return self.__setting_index
+
+    def update(self, size_B: int, capture_s: float, link: Link) -> None:
+        """
+        Feedback after the frame is encoded and queued for sending.
+        """
+
+
+class PidSizePolicy:
+    """
+    Adjusts the setting with a PID controller on the encoded size of the previous frame,
+    targeting the fraction of the current bandwidth available to each frame.
+    Only settings that encode faster than the frame interval on average are used,
+    so that the encoder keeps up with capture.
+    """
+
+    def __init__(self, settings: "list[Setting]") -> None:
+        candidates = [
+            index
+            for index, setting in enumerate(settings)
+            if setting.avg_time_s <= 1 / FRAME_RATE_HZ
+        ]
+        if len(candidates) == 0:
+            # None keeps up, use the fastest
+            candidates = [min(range(len(settings)), key=lambda index: settings[index].avg_time_s)]
+
+        # Settings by average size, as size is not monotonic in quality (e.g. PNG, HEIF)
+        self.__order = sorted(
+            candidates,
+            key=lambda index: (settings[index].avg_size_B, settings[index].quality),
+        )
+        # Continuous position in the order, rounded to choose a setting
+        self.__position = (len(self.__order) - 1) / 2
+        self.__max_position = len(self.__order) - 1
+        self.__integral = 0.0
+        self.__previous_error = 0.0
+
+    def select(  # pylint: disable=unused-argument
+        self,
+        capture_s: float,
+        encoder_free_s: float,
+        link: Link,
+        settings: "list[Setting]",
+    ) -> int:
+        """
+        See FixedPolicy.select() .
+        """
+        return self.__order[int(round(self.__position))]
+
+    def update(self, size_B: int, capture_s: float, link: Link) -> None:
+        """
+        See FixedPolicy.update() .
+        """
+        target_size_B = link.bandwidth_Bps(capture_s) * TARGET_LINK_UTILIZATION / FRAME_RATE_HZ
+        if target_size_B <= 0:
+            self.__position = 0
+            return
+
+        error = (target_size_B - size_B) / target_size_B
+        # Anti-windup
+        self.__integral = min(
+            max(self.__integral + error, -self.__max_position), self.__max_position
+        )
+        derivative = error - self.__previous_error
+        self.__previous_error = error
+
+        self.__position += PID_KP * error + PID_KI * self.__integral + PID_KD * derivative
+        self.__position = min(max(self.__position, 0), self.__max_position)
+
+
+class LookupPolicy:
+    """
+    Chooses the highest quality setting whose average encode time and size (precomputed from the
+    benchmark) let the frame be received within the latency target at the current bandwidth,
+    after the frames queued at the encoder and on the link.
+    """
+
+    def select(
+        self,
+        capture_s: float,
+        encoder_free_s: float,
+        link: Link,
+        settings: "list[Setting]",
+    ) -> int:
+        """
+        See FixedPolicy.select() .
+        """
+        bandwidth_Bps = link.bandwidth_Bps(capture_s) * TARGET_LINK_UTILIZATION
+
+        def get_latency_s(setting: Setting) -> float:
+            if bandwidth_Bps <= 0:
+                return float("inf")
+            # Encoding starts once the queued frames are encoded, sending once they are sent
+            encoded_s = max(capture_s, encoder_free_s) + setting.avg_time_s
+            received_s = max(encoded_s, link.free_s) + setting.avg_size_B / bandwidth_Bps
+            return received_s - capture_s
+
+        latencies_s = [get_latency_s(setting) for setting in settings]
+        fitting = [
+            index for index, latency_s in enumerate(latencies_s) if latency_s <= LATENCY_TARGET_S
+        ]
+        if len(fitting) == 0:
+            # Nothing fits, use the fastest to receive
+            return min(
+                range(len(settings)),
+                key=lambda index: (latencies_s[index], settings[index].avg_size_B),
+            )
+
+        return max(fitting, key=lambda index: (settings[index].quality, settings[index].avg_size_B))
+
+    def update(self, size_B: int, capture_s: float, link: Link) -> None:
+        """
+        See FixedPolicy.update() .
+        """
+
+
+def simulate(
+    policy: "FixedPolicy | PidSizePolicy | LookupPolicy",
+    settings: "list[Setting]",
+    trace: "list[tuple[float, float]]",
+) -> dict:
+    """
+    Runs a policy over the frame sequence.
+
+    Args:
+        policy: rate control policy
+        settings: see load_settings()
+        trace: see load_bandwidth_trace()
+
+    Returns: results of the policy
+    """
+    link = Link(trace)
+    frame_count = min(len(setting.frame_data) for setting in settings)
+    encoder_free_s = 0.0
+
+    deadline_misses = 0
+    total_quality = 0
+    total_latency_s = 0.0
+    max_latency_s = 0.0
+    total_size_B = 0
+    frame_data = []
+    for frame_index in range(frame_count):
+        capture_s = frame_index / FRAME_RATE_HZ
+        setting_index = policy.select(capture_s, encoder_free_s, link, settings)
+        setting = settings[setting_index]
+        frame = setting.frame_data[frame_index]
+
+        # Frames are encoded one at a time
+        encode_start_s = max(capture_s, encoder_free_s)
+        encoder_free_s = encode_start_s + frame["time_ns"] / 1e9
+        received_s = link.send(encoder_free_s, frame["size_B"])
+        policy.update(frame["size_B"], capture_s, link)
+
+        latency_s = received_s - capture_s
+        missed = latency_s > LATENCY_TARGET_S
+        deadline_misses += int(missed)
+        total_quality += setting.quality
+        total_latency_s += latency_s
+        max_latency_s = max(max_latency_s, latency_s)
+        total_size_B += frame["size_B"]
+        frame_data.append(
+            {
+                "setting": setting.name,
+                "quality": setting.quality,
+                "size_B": frame["size_B"],
+                "latency_ms": latency_s * 1e3,
+                "deadline_missed": missed,
+            }
+        )
+
+    # Utilization over the duration of the sequence or until the last frame is received
+    end_s = frame_count / FRAME_RATE_HZ
+    if link.free_s != float("inf"):
+        end_s = max(end_s, link.free_s)
+    capacity_B = link.capacity_B(0, end_s)
+
+    return {
+        DEADLINE_MISSES: deadline_misses,
+        DEADLINE_MISS_RATE: 100 * deadline_misses / frame_count,
+        AVG_QUALITY: total_quality / frame_count,
+        AVG_LATENCY_MS: total_latency_s / frame_count * 1e3,
+        MAX_LATENCY_MS: max_latency_s * 1e3,
+        LINK_UTILIZATION: 100 * min(total_size_B, capacity_B) / capacity_B if capacity_B > 0 else 0,
+        AVG_SIZE_B: total_size_B / frame_count,
+        FRAME_DATA: frame_data,
+    }
+
+
+def main() -> int:
+    """
+    Main function.
+    """
+    if not INPUT_RESULTS_PATH.exists():
+        print(f"Benchmark results not found: {INPUT_RESULTS_PATH}")
+        return -1
+
+    with open(INPUT_RESULTS_PATH, "r", encoding="utf-8") as file:
+        settings = load_settings(json.load(file))
+
+    if len(settings) == 0:
+        print(f"No settings with frame data in: {INPUT_RESULTS_PATH}")
+        return -1
+
+    trace = load_bandwidth_trace()
+
+    OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
+
+    policies = {f"fixed_{setting.name}": FixedPolicy(i) for i, setting in enumerate(settings)}
+    policies["pid_size"] = PidSizePolicy(settings)
+    policies["lookup"] = LookupPolicy()
+
+    results = {}
+    for name, policy in policies.items():
+        results[name] = simulate(policy, settings, trace)
+        print(
+            f"{name}: {results[name][DEADLINE_MISSES]} deadline misses, "
+            f"avg quality {results[name][AVG_QUALITY]:.1f}, "
+            f"link utilization {results[name][LINK_UTILIZATION]:.1f}%"
+        )
+
+    # Saving full results
+    with open(pathlib.Path(OUTPUT_PATH, "results.json"), "w", encoding="utf-8") as file:
+        file.write(json.dumps(results, indent=2))
+
+    # Saving shortcut results without frame data (for more human readability)
+    with open(pathlib.Path(OUTPUT_PATH, "summary.csv"), "w", encoding="utf-8") as file:
+        file.write(HEADER_LINE)
+        for name, current_result in results.items():
+            line_stats = [
+                name,
+                str(current_result[DEADLINE_MISSES]),
+                str(current_result[DEADLINE_MISS_RATE]),
+                str(current_result[AVG_QUALITY]),
+                str(current_result[AVG_LATENCY_MS]),
+                str(current_result[MAX_LATENCY_MS]),
+                str(current_result[LINK_UTILIZATION]),
+                str(current_result[AVG_SIZE_B]),
+            ]
+            line = ",".join(line_stats) + "\n"
+            file.write(line)
+
+    return 0
+
+
+if __name__ == "__main__":
+    result_main = main()
+    if result_main < 0:
+        print(f"ERROR: Status code: {result_main}")
+
+    print("Done!")
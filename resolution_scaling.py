@@ -0,0 +1,607 @@
+"""
+Measures how encode time, size and memory of each codec scale with resolution,
+to predict the cost of moving to a higher resolution camera.
+
+Inputs at each resolution are either resampled from the dataset (landing pad images captured
+from a flight test) or generated with a texture and noise of the same scale in pixels
+at every resolution. Each codec is encoded with one setting of its benchmark, through the encode()
+of the benchmark module. Peak memory is measured in a separate process for each encode,
+as the increase of its peak resident memory over a process that only loads the frame.
+Time, size and peak memory are fitted against megapixels
+with linear, n log n and power law curves, and the throughput (MP/s) of each resolution shows
+where the codec stops scaling linearly.
+
+Creates a folder with a .json with the test data and the fitted curves,
+a .csv which summarizes each resolution and a .csv with the fitted curves.
+"""
+
+import gc
+import io
+import json
+import math
+import multiprocessing
+import multiprocessing.connection
+import pathlib
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pillow_heif
+from PIL import Image
+
+import avif_benchmark
+import cpu_usage
+import heif_benchmark
+import jpeg_benchmark
+import png_benchmark
+import run_environment
+import webp_benchmark
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+# Setting parameters
+INPUT_PATH = pathlib.Path("test_images", "Encode Test Dataset 2024")
+DATASET_FRAME_COUNT = 300  # Total number of frames in the dataset
+FRAME_COUNT = 5  # Frames encoded at each resolution, spread evenly over the dataset
+OUTPUT_PATH = pathlib.Path("logs", str(int(time.time())))
+# (width, height)
+RESOLUTIONS = [
+    (640, 480),
+    (1280, 720),
+    (1920, 1080),
+    (2560, 1440),
+    (3840, 2160),
+    (7680, 4320),
+]
+SOURCES = ["resampled", "synthetic"]
+RESAMPLE = Image.Resampling.BICUBIC
+# Synthetic texture is smooth random colour at this scale, plus Gaussian noise
+SYNTHETIC_TEXTURE_SCALE_PX = 32
+SYNTHETIC_NOISE_SIGMA = 8
+SYNTHETIC_SEED = 0
+
+# Codec: path of the setting in the results of its benchmark (keys from get_settings())
+SETTING_KEYS = {
+    "PNG": "compress_type_0/compress_level_6",
+    "JPEG": "lossy_70/subsampling_2_optimize_False_progressive_False_qtables_None"
+    "_restart_marker_rows_0",
+    "WEBP": "lossy_70/method_4",
+    "HEIF": "quality_70/chroma_420",
+    "AVIF": "quality_70/chroma_420",
+}
+
+# Starting a process for each encode is slower than the timed encodes
+MEASURE_PEAK_MEMORY = True
+# Peak resident memory of a process in kB (VmHWM)
+PROC_STATUS_PATH = pathlib.Path("/proc/self/status")
+# Writing 5 resets the peak resident memory to the current resident memory
+PROC_CLEAR_REFS_PATH = pathlib.Path("/proc/self/clear_refs")
+# ru_maxrss is in KiB on Linux and in bytes on macOS
+MAXRSS_UNIT_B = 1 if sys.platform == "darwin" else 1024
+# Throughput this far below the highest throughput of a codec is no longer linear scaling
+LINEAR_SCALING_TOLERANCE = 0.2
+
+# Benchmark of each codec, see get_settings() and encode() of each module
+BENCHMARKS = {
+    "PNG": png_benchmark,
+    "JPEG": jpeg_benchmark,
+    "WEBP": webp_benchmark,
+    "HEIF": heif_benchmark,
+    "AVIF": avif_benchmark,
+}
+
+# Time between samples of CPU frequency, load and throttling
+MONITOR_INTERVAL_S = 0.5
+
+# Keys for dictionary entries
+SETTING = "setting"
+PARAMETERS = "parameters"
+MEGAPIXELS = "megapixels"
+AVG_TIME_MS = "avg_time_ms"
+AVG_CPU_TIME_MS = "avg_cpu_time_ms"
+AVG_CORES_USED = "avg_cores_used"
+THROUGHPUT_MPPS = "throughput_MP/s"
+AVG_SIZE_B = "avg_size_B"
+MAX_PEAK_MEMORY_B = "max_peak_memory_B"
+FRAME_DATA = "frame_data"
+START_TIME_NS = "start_time_ns"
+END_TIME_NS = "end_time_ns"
+CONTENTION = "contention"
+RESOLUTIONS_KEY = "resolutions"
+FITS = "fits"
+LINEAR_UNTIL_MEGAPIXELS = "linear_until_megapixels"
+
+# Metric: key of the average at each resolution
+FIT_METRICS = {
+    "time_ms": AVG_TIME_MS,
+    "size_B": AVG_SIZE_B,
+    "peak_memory_B": MAX_PEAK_MEMORY_B,
+}
+
+# For output csv files
+HEADERS = [
+    "Source",
+    "Codec",
+    "Width",
+    "Height",
+    "Megapixels",
+    "Avg Time (ms)",
+    "Avg CPU Time (ms)",
+    "Avg Cores Used",
+    "Throughput (MP/s)",
+    "Avg Size (B)",
+    "Max Peak Memory (B)",
+    "Contended",
+]
+HEADER_LINE = ",".join(HEADERS) + "\n"
+FIT_HEADERS = [
+    "Source",
+    "Codec",
+    "Metric",
+    "Model",
+    "Coefficients",
+    "R Squared",
+    "Best",
+    "Linear Until (MP)",
+]
+FIT_HEADER_LINE = ",".join(FIT_HEADERS) + "\n"
+
+
+def make_resampled(image: Image.Image, width: int, height: int) -> Image.Image:
+    """
+    Resamples a frame of the dataset to the resolution.
+    """
+    return image.convert("RGB").resize((width, height), RESAMPLE)
+
+
+def make_synthetic(width: int, height: int, seed: int) -> Image.Image:
+    """
+    Generates a frame with a smooth random colour texture and Gaussian noise.
+    The texture and noise have the same scale in pixels at every resolution.
+    """
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(
+        0,
+        256,
+        (
+            math.ceil(height / SYNTHETIC_TEXTURE_SCALE_PX) + 1,
+            math.ceil(width / SYNTHETIC_TEXTURE_SCALE_PX) + 1,
+            3,
+        ),
+        dtype=np.uint8,
+    )
+    texture = np.asarray(Image.fromarray(coarse).resize((width, height), Image.Resampling.BICUBIC))
+    noise = rng.normal(0, SYNTHETIC_NOISE_SIGMA, texture.shape)
+
+    return Image.fromarray(np.clip(texture + noise, 0, 255).astype(np.uint8))
+
+
+def get_parameters(codec: str, setting_key: str) -> "dict | None":
+    """
+    Encoder parameters of a setting of the benchmark of a codec.
+
+    Args:
+        codec: codec in BENCHMARKS
+        setting_key: path of the setting, see SETTING_KEYS
+
+    Returns: parameters, see get_settings() of the benchmark, None if the setting does not exist
+    """
+    for keys, parameters in BENCHMARKS[codec].get_settings():
+        if "/".join(keys) == setting_key:
+            return parameters
+
+    return None
+
+
+def prepare_frame(codec: str, frame: Image.Image) -> "Image.Image | pillow_heif.HeifFile":
+    """
+    Converts a frame for the encode() of the benchmark of a codec, this is not timed.
+    """
+    if codec == "AVIF":
+        return avif_benchmark.prepare_frame(frame)
+
+    return frame
+
+
+def _peak_resident_memory_bytes() -> "int | None":
+    # On Linux ru_maxrss keeps the peak of the parent process across fork and exec,
+    # while VmHWM only covers the memory of the current program
+    try:
+        for line in PROC_STATUS_PATH.read_text(encoding="utf-8").splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT_B
+
+
+def _peak_memory_process(
+    frame_path: str,
+    codec: str,
+    parameters: dict,
+    is_encoded: bool,
+    connection: multiprocessing.connection.Connection,
+) -> None:
+    pillow_heif.register_heif_opener(thumbnails=False)
+    pillow_heif.register_avif_opener(thumbnails=False)
+
+    frame = prepare_frame(codec, Image.fromarray(np.load(frame_path)))
+    # Exclude the copies made while loading the frame, which can be larger than the encode
+    try:
+        PROC_CLEAR_REFS_PATH.write_text("5", encoding="utf-8")
+    except OSError:
+        pass
+
+    if is_encoded:
+        BENCHMARKS[codec].encode(frame, io.BytesIO(), parameters)
+
+    connection.send(_peak_resident_memory_bytes())
+    connection.close()
+
+
+def get_peak_memory(
+    frame_path: pathlib.Path,
+    codec: str,
+    parameters: dict,
+    is_encoded: bool,
+) -> "int | None":
+    """
+    Peak resident memory of a new process that loads a frame, prepares it for a codec
+    (see prepare_frame()) and encodes it with the encode() of the benchmark of the codec,
+    counted from after the frame is prepared where the platform allows it (Linux).
+    A new process is used so that the peak is not hidden by earlier encodes.
+
+    Args:
+        frame_path: frame saved with numpy.save()
+        codec: codec to encode the frame with
+        parameters: encoder parameters, see get_parameters()
+        is_encoded: False to only load and prepare the frame (baseline)
+
+    Returns: peak resident memory in bytes, None if it cannot be measured on this platform
+    """
+    # Not forked, so that the memory of this process is not part of the child
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_peak_memory_process,
+        args=(str(frame_path), codec, parameters, is_encoded, sender),
+    )
+    process.start()
+    sender.close()
+    peak_bytes = receiver.recv()
+    process.join()
+
+    return peak_bytes
+
+
+def fit_curves(megapixels: "list[float]", values: "list[float]") -> dict:
+    """
+    Fits curves of a metric against megapixels.
+
+    Models:
+        linear: a + b * n
+        n_log_n: a + b * n * log2(pixels)
+        power: a * n ** b (fitted in log-log, b is the scaling exponent)
+
+    Returns: model: {coefficients, r_squared}, and best: name of the model with the highest R²
+    """
+    x = np.array(megapixels, dtype=np.float64)
+    y = np.array(values, dtype=np.float64)
+    designs = {
+        "linear": np.column_stack([np.ones_like(x), x]),
+        "n_log_n": np.column_stack([np.ones_like(x), x * np.log2(x * 1e6)]),
+    }
+
+    fits = {}
+    total_sum_of_squares = float(np.sum((y - y.mean()) ** 2))
+    for model, design in designs.items():
+        coefficients = np.linalg.lstsq(design, y, rcond=None)[0]
+        residual = float(np.sum((y - design @ coefficients) ** 2))
+        fits[model] = {
+            "coefficients": coefficients.tolist(),
+            "r_squared": 1 - residual / total_sum_of_squares if total_sum_of_squares > 0 else 1.0,
+        }
+
+    if np.all(y > 0):
+        exponent, log_scale = np.polyfit(np.log(x), np.log(y), 1)
+        predictions = np.exp(log_scale) * x**exponent
+        residual = float(np.sum((y - predictions) ** 2))
+        fits["power"] = {
+            "coefficients": [float(np.exp(log_scale)), float(exponent)],
+            "r_squared": 1 - residual / total_sum_of_squares if total_sum_of_squares > 0 else 1.0,
+        }
+
+    fits["best"] = max(fits, key=lambda model: fits[model]["r_squared"])
+
+    return fits
+
+
+def get_linear_until(megapixels: "list[float]", throughputs: "list[float]") -> "float | None":
+    """
+    Largest resolution up to which the throughput stays within LINEAR_SCALING_TOLERANCE
+    of the highest throughput (smaller resolutions are dominated by fixed costs).
+
+    Returns: megapixels, None if the throughput never drops
+    """
+    peak_index = int(np.argmax(throughputs))
+    for index in range(peak_index + 1, len(throughputs)):
+        if throughputs[index] < throughputs[peak_index] * (1 - LINEAR_SCALING_TOLERANCE):
+            return megapixels[index - 1]
+
+    return None
+
+
+def main() -> int:
+    """
+    Main function.
+    """
+    pillow_heif.register_heif_opener(thumbnails=False)
+    pillow_heif.register_avif_opener(thumbnails=False)
+
+    if FRAME_COUNT > DATASET_FRAME_COUNT:
+        print(f"Frame count must be at most {DATASET_FRAME_COUNT}: {FRAME_COUNT}")
+        return -1
+
+    codec_parameters = {}
+    for codec, setting_key in SETTING_KEYS.items():
+        parameters = get_parameters(codec, setting_key)
+        if parameters is None:
+            print(f"Setting not found in the {codec} benchmark: {setting_key}")
+            return -1
+        codec_parameters[codec] = parameters
+
+    OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
+
+    frame_indices = np.linspace(0, DATASET_FRAME_COUNT - 1, FRAME_COUNT).astype(int).tolist()
+    dataset_frames = []
+    if "resampled" in SOURCES:
+        for frame_index in frame_indices:
+            image = Image.open(pathlib.Path(INPUT_PATH, f"{frame_index}.png"))
+            image.load()
+            dataset_frames.append(image)
+
+    results = {
+        source: {
+            codec: {
+                SETTING: setting_key,
+                PARAMETERS: codec_parameters[codec],
+                RESOLUTIONS_KEY: {},
+                FITS: {},
+            }
+            for codec, setting_key in SETTING_KEYS.items()
+        }
+        for source in SOURCES
+    }
+
+    fingerprint = run_environment.get_fingerprint()
+    monitor = run_environment.EnvironmentMonitor(MONITOR_INTERVAL_S)
+    monitor.start()
+    cell_results = []
+
+    test_begin = time.time()
+    print("Start time:", test_begin)
+
+    for source in SOURCES:
+        print(f"-----------------SOURCE = {source}--------------------")
+        for width, height in RESOLUTIONS:
+            # Generated once per resolution, outside of the measurements
+            if source == "resampled":
+                frames = [make_resampled(image, width, height) for image in dataset_frames]
+            else:
+                frames = [
+                    make_synthetic(width, height, SYNTHETIC_SEED + i) for i in range(FRAME_COUNT)
+                ]
+
+            # Inputs of the peak memory processes
+            with tempfile.TemporaryDirectory() as frame_directory:
+                frame_paths = []
+                if MEASURE_PEAK_MEMORY:
+                    for i, frame in enumerate(frames):
+                        frame_path = pathlib.Path(frame_directory, f"{i}.npy")
+                        np.save(frame_path, np.asarray(frame))
+                        frame_paths.append(frame_path)
+
+                megapixels = width * height / 1e6
+                for codec, parameters in codec_parameters.items():
+                    total_time_ns = 0
+                    total_user_time_ns = 0
+                    total_system_time_ns = 0
+                    total_size_B = 0
+                    max_peak_memory_B = None
+                    current_result = {
+                        "width": width,
+                        "height": height,
+                        MEGAPIXELS: megapixels,
+                        FRAME_DATA: [],
+                    }
+                    current_result[START_TIME_NS] = time.time_ns()
+                    for frame_index, frame in zip(frame_indices, frames):
+                        img = prepare_frame(codec, frame)
+                        buffer = io.BytesIO()
+
+                        # Running encode
+                        gc.disable()
+                        start_user_ns, start_system_ns = cpu_usage.get_cpu_times_ns()
+                        start = time.time_ns()
+                        BENCHMARKS[codec].encode(img, buffer, parameters)
+                        end = time.time_ns()
+                        end_user_ns, end_system_ns = cpu_usage.get_cpu_times_ns()
+                        gc.enable()
+
+                        # Save singular test results
+                        time_ns = end - start
+                        user_time_ns = end_user_ns - start_user_ns
+                        system_time_ns = end_system_ns - start_system_ns
+                        size_B = buffer.getbuffer().nbytes
+
+                        total_time_ns += time_ns
+                        total_user_time_ns += user_time_ns
+                        total_system_time_ns += system_time_ns
+                        total_size_B += size_B
+                        current_result[FRAME_DATA].append(
+                            {
+                                # Dataset frame the input was resampled from
+                                "frame_index": frame_index if source == "resampled" else None,
+                                "time_ns": time_ns,
+                                "user_time_ns": user_time_ns,
+                                "system_time_ns": system_time_ns,
+                                "cores_used": cpu_usage.get_cores_used(
+                                    user_time_ns + system_time_ns,
+                                    time_ns,
+                                ),
+                                "size_B": size_B,
+                                "peak_memory_B": None,
+                            }
+                        )
+
+                    current_result[END_TIME_NS] = time.time_ns()
+                    cell_results.append(current_result)
+
+                    # After the timed encodes, as the other processes would contend with them
+                    for frame_path, frame_result in zip(frame_paths, current_result[FRAME_DATA]):
+                        baseline_bytes = get_peak_memory(frame_path, codec, parameters, False)
+                        peak_bytes = get_peak_memory(frame_path, codec, parameters, True)
+                        if peak_bytes is None or baseline_bytes is None:
+                            continue
+
+                        frame_result["peak_memory_B"] = max(peak_bytes - baseline_bytes, 0)
+                        max_peak_memory_B = max(
+                            max_peak_memory_B or 0, frame_result["peak_memory_B"]
+                        )
+
+                    # Save average test results
+                    current_result[AVG_TIME_MS] = total_time_ns / FRAME_COUNT / 1e6
+                    current_result[AVG_CPU_TIME_MS] = (
+                        (total_user_time_ns + total_system_time_ns) / FRAME_COUNT / 1e6
+                    )
+                    current_result[AVG_CORES_USED] = cpu_usage.get_cores_used(
+                        total_user_time_ns + total_system_time_ns,
+                        total_time_ns,
+                    )
+                    current_result[THROUGHPUT_MPPS] = megapixels / (
+                        current_result[AVG_TIME_MS] / 1e3
+                    )
+                    current_result[AVG_SIZE_B] = total_size_B / FRAME_COUNT
+                    current_result[MAX_PEAK_MEMORY_B] = max_peak_memory_B
+                    results[source][codec][RESOLUTIONS_KEY][f"{width}x{height}"] = current_result
+                    print(
+                        f"{codec} {width}x{height}: {current_result[AVG_TIME_MS]:.1f} ms, "
+                        f"{current_result[THROUGHPUT_MPPS]:.1f} MP/s"
+                    )
+
+            # Release the frames before generating the next resolution
+            frames = []
+
+    # Fitting curves
+    for source in SOURCES:
+        for codec in SETTING_KEYS:
+            resolution_results = list(results[source][codec][RESOLUTIONS_KEY].values())
+            megapixels = [current_result[MEGAPIXELS] for current_result in resolution_results]
+            for metric, key in FIT_METRICS.items():
+                values = [current_result[key] for current_result in resolution_results]
+                if any(value is None for value in values):
+                    continue
+                results[source][codec][FITS][metric] = fit_curves(megapixels, values)
+
+            results[source][codec][LINEAR_UNTIL_MEGAPIXELS] = get_linear_until(
+                megapixels,
+                [current_result[THROUGHPUT_MPPS] for current_result in resolution_results],
+            )
+
+    # Flag settings timed under contention
+    monitor.stop()
+    contended_count = 0
+    for current_result in cell_results:
+        current_result[CONTENTION] = monitor.check(
+            current_result[START_TIME_NS],
+            current_result[END_TIME_NS],
+        )
+        contended_count += int(current_result[CONTENTION][run_environment.CONTENDED])
+    print(f"{contended_count} of {len(cell_results)} settings were timed under contention")
+
+    print("")
+    print("-------------------TEST COMPLETED------------------")
+    print("")
+
+    # Saving full results
+    with open(pathlib.Path(OUTPUT_PATH, "results.json"), "w", encoding="utf-8") as file:
+        file.write(json.dumps(results, indent=2))
+
+    # Saving run environment
+    with open(pathlib.Path(OUTPUT_PATH, "environment.json"), "w", encoding="utf-8") as file:
+        file.write(json.dumps({"fingerprint": fingerprint, "samples": monitor.samples}, indent=2))
+
+    # Saving shortcut results without frame data (for more human readability)
+    with open(pathlib.Path(OUTPUT_PATH, "summary.csv"), "w", encoding="utf-8") as file:
+        file.write(HEADER_LINE)
+        for source in SOURCES:
+            for codec in SETTING_KEYS:
+                for current_result in results[source][codec][RESOLUTIONS_KEY].values():
+                    line_stats = [
+                        source,
+                        codec,
+                        str(current_result["width"]),
+                        str(current_result["height"]),
+                        str(current_result[MEGAPIXELS]),
+                        str(current_result[AVG_TIME_MS]),
+                        str(current_result[AVG_CPU_TIME_MS]),
+                        str(current_result[AVG_CORES_USED]),
+                        str(current_result[THROUGHPUT_MPPS]),
+                        str(current_result[AVG_SIZE_B]),
+                        str(current_result[MAX_PEAK_MEMORY_B]),
+                        str(current_result[CONTENTION][run_environment.CONTENDED]),
+                    ]
+                    line = ",".join(line_stats) + "\n"
+                    file.write(line)
+
+    with open(pathlib.Path(OUTPUT_PATH, "fits.csv"), "w", encoding="utf-8") as file:
+        file.write(FIT_HEADER_LINE)
+        for source in SOURCES:
+            for codec in SETTING_KEYS:
+                for metric, fits in results[source][codec][FITS].items():
+                    for model, fit in fits.items():
+                        if model == "best":
+                            continue
+                        line_stats = [
+                            source,
+                            codec,
+                            metric,
+                            model,
+                            # Space separated, the csv has no quoting
+                            " ".join(str(coefficient) for coefficient in fit["coefficients"]),
+                            str(fit["r_squared"]),
+                            str(model == fits["best"]),
+                            str(results[source][codec][LINEAR_UNTIL_MEGAPIXELS]),
+                        ]
+                        line = ",".join(line_stats) + "\n"
+                        file.write(line)
+
+    test_end = time.time()
+    print("End time:", test_end)
+    print(
+        "Time taken:",
+        int((test_end - test_begin) / 60),
+        "mins",
+        int(test_end - test_begin) % 60,
+        "secs",
+    )
+
+    return 0
+
+
+if __name__ == "__main__":
+    result_main = main()
+    if result_main < 0:
+        print(f"ERROR: Status code: {result_main}")
+
+    print("Done!")
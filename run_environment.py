@@ -0,0 +1,303 @@
+"""
+Captures the environment of a benchmark run (machine, OS, library versions)
+and monitors CPU frequency, load and thermal throttling during the run,
+so that timing measured under contention can be flagged.
+
+CPU frequency, load and throttling are read from /proc and /sys, and are None on other platforms.
+"""
+
+import json
+import os
+import pathlib
+import platform
+import sys
+import threading
+import time
+import zlib
+
+
+PROC_STAT_PATH = pathlib.Path("/proc/stat")
+CPU_INFO_PATH = pathlib.Path("/proc/cpuinfo")
+CPU_SYSFS_PATH = pathlib.Path("/sys/devices/system/cpu")
+
+# Contention thresholds
+# Number of cores used by other processes
+OTHER_BUSY_CORES_THRESHOLD = 0.5
+# CPU frequency relative to the highest frequency sampled during the run
+FREQUENCY_RATIO_THRESHOLD = 0.9
+
+# Libraries (see _library_versions()) that the output and timing of each encoder depend on
+ENCODER_LIBRARIES = {
+    "PNG": ["Pillow", "Pillow_zlib"],
+    # parallel_png compresses with the zlib of the Python build
+    "PNG_parallel": ["zlib"],
+    "JPEG": ["Pillow", "Pillow_libjpeg_turbo"],
+    "WEBP": ["Pillow", "Pillow_webp"],
+    # Includes the versions of the encoder plugins (e.g. x265, aom)
+    "HEIF": ["pillow_heif", "libheif", "libheif_info"],
+    "AVIF": ["pillow_heif", "libheif", "libheif_info"],
+}
+
+# Keys for dictionary entries
+TIME_NS = "time_ns"
+CPU_FREQUENCY_MHZ = "cpu_frequency_MHz"
+LOAD_AVERAGE_1MIN = "load_average_1min"
+OTHER_BUSY_CORES = "other_busy_cores"
+THROTTLE_COUNT = "throttle_count"
+CONTENDED = "contended"
+CONTENTION_REASONS = "contention_reasons"
+
+
+def _read_text(path: pathlib.Path) -> "str | None":
+    try:
+        return path.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+
+
+def _cpu_model() -> str:
+    cpu_info = _read_text(CPU_INFO_PATH)
+    if cpu_info is not None:
+        for line in cpu_info.splitlines():
+            if line.startswith("model name") or line.startswith("Model"):
+                return line.split(":", 1)[1].strip()
+
+    return platform.processor()
+
+
+def _library_versions() -> dict:
+    versions: dict = {
+        "python": sys.version.split()[0],
+        "zlib": zlib.ZLIB_RUNTIME_VERSION,
+    }
+
+    try:
+        import PIL  # pylint: disable=import-outside-toplevel
+        from PIL import features  # pylint: disable=import-outside-toplevel
+
+        versions["Pillow"] = PIL.__version__
+        for feature in ["zlib", "libjpeg_turbo", "webp", "avif"]:
+            try:
+                versions[f"Pillow_{feature}"] = features.version(feature)
+            except ValueError:
+                # Unknown to this version of Pillow
+                versions[f"Pillow_{feature}"] = None
+    except ImportError:
+        versions["Pillow"] = None
+
+    try:
+        import pillow_heif  # pylint: disable=import-outside-toplevel
+
+        versions["pillow_heif"] = pillow_heif.__version__
+        versions["libheif"] = pillow_heif.libheif_version()
+        # Includes the versions of the encoder plugins (e.g. x265, aom)
+        versions["libheif_info"] = pillow_heif.libheif_info()
+    except ImportError:
+        versions["pillow_heif"] = None
+
+    return versions
+
+
+def get_encoder_version(encoder: str) -> str:
+    """
+    Versions of the libraries used by an encoder, e.g. for keying cached encode results.
+
+    Args:
+        encoder: key of ENCODER_LIBRARIES
+
+    Returns: versions as a JSON string
+    """
+    versions = _library_versions()
+
+    return json.dumps(
+        {name: versions.get(name) for name in ENCODER_LIBRARIES[encoder]}, sort_keys=True
+    )
+
+
+def get_fingerprint() -> dict:
+    """
+    Describes the machine and software the benchmark runs on.
+
+    Returns: JSON serializable fingerprint
+    """
+    load_average = None
+    if hasattr(os, "getloadavg"):
+        load_average = list(os.getloadavg())
+
+    return {
+        "hostname": platform.node(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_model": _cpu_model(),
+        "cpu_count": os.cpu_count(),
+        "cpu_affinity_count": (
+            len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+        ),
+        "frequency_governor": _read_text(
+            pathlib.Path(CPU_SYSFS_PATH, "cpu0", "cpufreq", "scaling_governor")
+        ),
+        "max_frequency_MHz": _max_frequency_mhz(),
+        "load_average": load_average,
+        "library_versions": _library_versions(),
+    }
+
+
+def _max_frequency_mhz() -> "float | None":
+    max_frequency = _read_text(pathlib.Path(CPU_SYSFS_PATH, "cpu0", "cpufreq", "cpuinfo_max_freq"))
+    if max_frequency is None:
+        return None
+
+    return int(max_frequency) / 1e3
+
+
+def _current_frequency_mhz() -> "float | None":
+    frequencies = []
+    for path in CPU_SYSFS_PATH.glob("cpu[0-9]*/cpufreq/scaling_cur_freq"):
+        frequency = _read_text(path)
+        if frequency is not None:
+            frequencies.append(int(frequency) / 1e3)
+
+    if len(frequencies) == 0:
+        return None
+
+    # Idle cores are scaled down, the fastest core is the one running the encode
+    return max(frequencies)
+
+
+def _throttle_count() -> "int | None":
+    counts = []
+    for path in CPU_SYSFS_PATH.glob("cpu[0-9]*/thermal_throttle/core_throttle_count"):
+        count = _read_text(path)
+        if count is not None:
+            counts.append(int(count))
+
+    if len(counts) == 0:
+        return None
+
+    return sum(counts)
+
+
+def _cpu_times_s() -> "tuple[float, float] | None":
+    """
+    Returns: (busy_s, total_s) summed over all cores since boot
+    """
+    proc_stat = _read_text(PROC_STAT_PATH)
+    if proc_stat is None:
+        return None
+
+    # cpu user nice system idle iowait irq softirq steal ...
+    fields = [int(field) for field in proc_stat.splitlines()[0].split()[1:]]
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    idle = fields[3] + fields[4]
+    total = sum(fields[:8])
+
+    return (total - idle) / clock_ticks, total / clock_ticks
+
+
+class EnvironmentMonitor:
+    """
+    Samples CPU frequency, load and throttling in a background thread.
+    """
+
+    def __init__(self, interval_s: float) -> None:
+        """
+        interval_s: time between samples
+        """
+        self.__interval_s = interval_s
+        self.__stop_event = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.samples: "list[dict]" = []
+
+    def start(self) -> None:
+        """
+        Starts sampling.
+        """
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops sampling.
+        """
+        self.__stop_event.set()
+        self.__thread.join()
+
+    def __run(self) -> None:
+        previous_cpu_times_s = _cpu_times_s()
+        previous_process_s = time.process_time()
+        previous_time_ns = time.time_ns()
+        while not self.__stop_event.wait(self.__interval_s):
+            cpu_times_s = _cpu_times_s()
+            process_s = time.process_time()
+            time_ns = time.time_ns()
+
+            other_busy_cores = None
+            if cpu_times_s is not None and previous_cpu_times_s is not None:
+                elapsed_s = (time_ns - previous_time_ns) / 1e9
+                busy_cores = (cpu_times_s[0] - previous_cpu_times_s[0]) / elapsed_s
+                own_cores = (process_s - previous_process_s) / elapsed_s
+                other_busy_cores = max(busy_cores - own_cores, 0)
+
+            load_average = os.getloadavg()[0] if hasattr(os, "getloadavg") else None
+            self.samples.append(
+                {
+                    TIME_NS: time_ns,
+                    CPU_FREQUENCY_MHZ: _current_frequency_mhz(),
+                    LOAD_AVERAGE_1MIN: load_average,
+                    OTHER_BUSY_CORES: other_busy_cores,
+                    THROTTLE_COUNT: _throttle_count(),
+                }
+            )
+
+            previous_cpu_times_s = cpu_times_s
+            previous_process_s = process_s
+            previous_time_ns = time_ns
+
+    def check(self, start_ns: int, end_ns: int) -> dict:
+        """
+        Checks whether the measurements between the given times were made under contention.
+
+        Args:
+            start_ns: start of the measurements (from time.time_ns())
+            end_ns: end of the measurements (from time.time_ns())
+
+        Returns: JSON serializable contention flag, reasons and sample count
+        """
+        # A sample covers the interval before it
+        samples = [
+            sample
+            for sample in self.samples
+            if start_ns < sample[TIME_NS] <= end_ns + self.__interval_s * 1e9
+        ]
+
+        reasons = []
+        other_busy_cores = [
+            sample[OTHER_BUSY_CORES] for sample in samples if sample[OTHER_BUSY_CORES] is not None
+        ]
+        if len(other_busy_cores) > 0 and max(other_busy_cores) > OTHER_BUSY_CORES_THRESHOLD:
+            reasons.append(f"other processes used up to {max(other_busy_cores):.2f} cores")
+
+        frequencies_mhz = [
+            sample[CPU_FREQUENCY_MHZ] for sample in samples if sample[CPU_FREQUENCY_MHZ] is not None
+        ]
+        run_frequencies_mhz = [
+            sample[CPU_FREQUENCY_MHZ]
+            for sample in self.samples
+            if sample[CPU_FREQUENCY_MHZ] is not None
+        ]
+        if (
+            len(frequencies_mhz) > 0
+            and min(frequencies_mhz) < max(run_frequencies_mhz) * FREQUENCY_RATIO_THRESHOLD
+        ):
+            reasons.append(f"CPU frequency dropped to {min(frequencies_mhz):.0f} MHz")
+
+        throttle_counts = [
+            sample[THROTTLE_COUNT] for sample in samples if sample[THROTTLE_COUNT] is not None
+        ]
+        if len(throttle_counts) > 1 and throttle_counts[-1] > throttle_counts[0]:
+            reasons.append(f"thermal throttled {throttle_counts[-1] - throttle_counts[0]} times")
+
+        return {
+            CONTENDED: len(reasons) > 0,
+            CONTENTION_REASONS: reasons,
+            "sample_count": len(samples),
+        }
@@ -0,0 +1,139 @@
+"""
+Tests for the distributed sweep.
+"""
+
+import io
+import json
+import multiprocessing
+import pathlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import distributed_sweep
+import png_benchmark
+
+
+def test_tasks_cover_benchmark_settings() -> None:
+    """
+    Every setting of every benchmark is split into tasks that cover every frame once.
+    """
+    tasks = distributed_sweep.make_tasks()
+
+    for codec, benchmark in distributed_sweep.BENCHMARKS.items():
+        settings = benchmark.get_settings()
+        setting_keys = ["/".join(keys) for keys, _ in settings]
+        assert len(set(setting_keys)) == len(settings)
+
+        for setting_key, (_, parameters) in zip(setting_keys, settings):
+            setting_tasks = [
+                task
+                for task in tasks
+                if task["codec"] == codec and task["setting_key"] == setting_key
+            ]
+            assert all(task["parameters"] == parameters for task in setting_tasks)
+            frame_indices = [
+                frame_index
+                for task in setting_tasks
+                for frame_index in range(
+                    task["first_frame_index"],
+                    task["first_frame_index"] + task["frame_count"],
+                )
+            ]
+            assert frame_indices == list(range(distributed_sweep.FRAME_COUNT))
+
+    assert [task["task_id"] for task in tasks] == list(range(len(tasks)))
+
+
+def test_work_queue_leases() -> None:
+    """
+    A task is leased to one worker at a time until it is completed or its lease expires.
+    """
+    tasks = [{"task_id": 0}, {"task_id": 1}]
+    work_queue = distributed_sweep.WorkQueue(tasks, 600)
+
+    assert work_queue.lease() == ("task", tasks[0])
+    assert work_queue.lease() == ("task", tasks[1])
+    assert work_queue.lease() == ("wait", None)
+
+    work_queue.complete(1, {"worker_id": "a"})
+    # The first result wins
+    work_queue.complete(1, {"worker_id": "b"})
+    assert work_queue.results[1] == {"worker_id": "a"}
+    assert not work_queue.done_event.is_set()
+
+    work_queue.complete(0, {"worker_id": "b"})
+    assert work_queue.done_event.is_set()
+    assert work_queue.lease() == ("done", None)
+
+
+def test_work_queue_expired_lease() -> None:
+    """
+    A task whose lease expired is given to another worker.
+    """
+    tasks = [{"task_id": 0}]
+    work_queue = distributed_sweep.WorkQueue(tasks, 0)
+
+    assert work_queue.lease() == ("task", tasks[0])
+    assert work_queue.lease() == ("task", tasks[0])
+
+
+def test_local_workers_merge_results(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Several workers on this machine run a small grid through the coordinator,
+    and every frame of every setting is merged into the nested results once.
+    """
+    if multiprocessing.get_start_method() != "fork":
+        pytest.skip("Workers only inherit the patched settings when forked")
+
+    input_path = pathlib.Path(tmp_path, "frames")
+    input_path.mkdir()
+    rng = np.random.default_rng(0)
+    for frame_index in range(4):
+        Image.fromarray(rng.integers(0, 256, (16, 16, 3), dtype=np.uint8)).save(
+            pathlib.Path(input_path, f"{frame_index}.png")
+        )
+
+    output_path = pathlib.Path(tmp_path, "output")
+    monkeypatch.setattr(distributed_sweep, "BENCHMARKS", {"PNG": png_benchmark})
+    monkeypatch.setattr(png_benchmark, "COMPRESS_TYPES", [0])
+    monkeypatch.setattr(png_benchmark, "COMPRESS_LEVELS", [1, 9])
+    monkeypatch.setattr(distributed_sweep, "FRAME_COUNT", 4)
+    monkeypatch.setattr(distributed_sweep, "FRAMES_PER_TASK", 1)
+    monkeypatch.setattr(distributed_sweep, "INPUT_PATH", input_path)
+    monkeypatch.setattr(distributed_sweep, "OUTPUT_PATH", output_path)
+    monkeypatch.setattr(distributed_sweep, "COORDINATOR_HOST", "localhost")
+    monkeypatch.setattr(distributed_sweep, "COORDINATOR_PORT", 0)
+    monkeypatch.setattr(distributed_sweep, "SHUTDOWN_GRACE_S", 0.5)
+    monkeypatch.setattr(distributed_sweep, "POLL_INTERVAL_S", 0.1)
+    monkeypatch.setattr(distributed_sweep, "MONITOR_INTERVAL_S", 0.1)
+
+    assert distributed_sweep.run_coordinator(3) == 0
+
+    results = json.loads(pathlib.Path(output_path, "results.json").read_text(encoding="utf-8"))
+    environment = json.loads(
+        pathlib.Path(output_path, "environment.json").read_text(encoding="utf-8")
+    )
+    assert list(results) == ["PNG"]
+    assert list(results["PNG"]) == ["compress_type_0"]
+    assert list(results["PNG"]["compress_type_0"]) == ["compress_level_1", "compress_level_9"]
+    for keys, parameters in png_benchmark.get_settings():
+        current_result = results["PNG"][keys[0]][keys[1]]
+        frame_data = current_result[distributed_sweep.FRAME_DATA]
+        assert [frame["frame_index"] for frame in frame_data] == list(range(4))
+        for frame in frame_data:
+            buffer = io.BytesIO()
+            png_benchmark.encode(
+                Image.open(pathlib.Path(input_path, f"{frame['frame_index']}.png")),
+                buffer,
+                parameters,
+            )
+            assert frame["size_B"] == buffer.getbuffer().nbytes
+            assert frame["worker_id"] in current_result[distributed_sweep.WORKERS]
+        assert set(current_result[distributed_sweep.WORKERS]) <= set(environment["workers"])
+        assert current_result[distributed_sweep.AVG_SIZE_B] == pytest.approx(
+            sum(frame["size_B"] for frame in frame_data) / 4
+        )
@@ -0,0 +1,192 @@
+"""
+Tests for the encode result cache.
+"""
+
+import json
+import pathlib
+import time
+
+import pytest
+
+import encode_cache
+
+
+def make_result(size_B: int) -> dict:
+    """
+    Result that is stored in size_B bytes.
+    """
+    padding = size_B - len(json.dumps({"padding": ""}))
+    return {"padding": "x" * padding}
+
+
+def test_get_returns_stored_entry(tmp_path: pathlib.Path) -> None:
+    """
+    Stored results and encoded bytes are returned.
+    """
+    cache = encode_cache.EncodeCache(tmp_path, 1000)
+    cache.put("a", {"size_B": 3}, b"abc")
+    cache.put("b", {"size_B": 0})
+
+    assert cache.get("a") == ({"size_B": 3}, b"abc")
+    assert cache.get("b") == ({"size_B": 0}, None)
+    assert cache.get("c") is None
+    assert cache.hits == 2
+    assert cache.misses == 1
+
+
+def test_evicts_least_recently_used(tmp_path: pathlib.Path) -> None:
+    """
+    Entries that were not accessed recently are evicted first when the cache is full.
+    """
+    cache = encode_cache.EncodeCache(tmp_path, 300)
+    cache.put("a", make_result(100))
+    cache.put("b", make_result(100))
+    cache.put("c", make_result(100))
+    # a is now more recently used than b
+    assert cache.get("a") is not None
+
+    cache.put("d", make_result(100))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.get("d") is not None
+    assert not pathlib.Path(tmp_path, "b.json").exists()
+
+
+def test_evicts_by_total_size(tmp_path: pathlib.Path) -> None:
+    """
+    The size of the encoded bytes counts towards the bound.
+    """
+    cache = encode_cache.EncodeCache(tmp_path, 250)
+    cache.put("a", make_result(50), bytes(50))
+    cache.put("b", make_result(50), bytes(50))
+    cache.put("c", make_result(50), bytes(50))
+
+    assert cache.get("a") is None
+    assert not pathlib.Path(tmp_path, "a.bin").exists()
+    assert cache.get("b") is not None
+    assert cache.get("c") is not None
+
+
+def test_replacing_entry_does_not_count_twice(tmp_path: pathlib.Path) -> None:
+    """
+    Storing a key again replaces its entry.
+    """
+    cache = encode_cache.EncodeCache(tmp_path, 200)
+    cache.put("a", make_result(100))
+    cache.put("b", make_result(100))
+    cache.put("b", make_result(100))
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is not None
+
+
+def test_access_order_persists(tmp_path: pathlib.Path) -> None:
+    """
+    The access order is read back from the saved index.
+    """
+    cache = encode_cache.EncodeCache(tmp_path, 300)
+    cache.put("a", make_result(100))
+    cache.put("b", make_result(100))
+    assert cache.get("a") is not None
+    cache.save()
+
+    cache = encode_cache.EncodeCache(tmp_path, 300)
+    cache.put("c", make_result(100))
+    cache.put("d", make_result(100))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+
+def test_recovers_entries_without_saved_index(tmp_path: pathlib.Path) -> None:
+    """
+    Entries stored by a run that exited before save() are found and count towards the bound.
+    """
+    cache = encode_cache.EncodeCache(tmp_path, 1000)
+    for key in ["a", "b", "c", "d"]:
+        cache.put(key, make_result(100), bytes(100))
+    # No save()
+
+    cache = encode_cache.EncodeCache(tmp_path, 500)
+
+    total_size_B = sum(path.stat().st_size for path in tmp_path.iterdir())
+    assert total_size_B <= 500
+    assert cache.get("d") is not None
+
+
+def test_removes_incomplete_entries(tmp_path: pathlib.Path) -> None:
+    """
+    Encoded bytes without results are deleted, index entries without files are dropped.
+    """
+    cache = encode_cache.EncodeCache(tmp_path, 1000)
+    cache.put("a", make_result(100))
+    cache.save()
+    pathlib.Path(tmp_path, "a.json").unlink()
+    pathlib.Path(tmp_path, "b.bin").write_bytes(bytes(100))
+
+    cache = encode_cache.EncodeCache(tmp_path, 1000)
+
+    assert cache.get("a") is None
+    assert not pathlib.Path(tmp_path, "b.bin").exists()
+
+
+def test_unreadable_index_is_rebuilt(tmp_path: pathlib.Path) -> None:
+    """
+    An index left half written by a crash does not prevent opening the cache.
+    """
+    cache = encode_cache.EncodeCache(tmp_path, 1000)
+    cache.put("a", make_result(100))
+    cache.save()
+    index_path = pathlib.Path(tmp_path, encode_cache.INDEX_FILE_NAME)
+    index_path.write_text(index_path.read_text(encoding="utf-8")[:10], encoding="utf-8")
+
+    cache = encode_cache.EncodeCache(tmp_path, 1000)
+
+    assert cache.get("a") is not None
+
+
+def test_save_replaces_index(tmp_path: pathlib.Path) -> None:
+    """
+    The index is written through a temporary file.
+    """
+    cache = encode_cache.EncodeCache(tmp_path, 1000)
+    cache.put("a", make_result(100))
+    cache.save()
+    cache.save()
+
+    assert pathlib.Path(tmp_path, encode_cache.INDEX_FILE_NAME).exists()
+    assert not pathlib.Path(tmp_path, encode_cache.TEMPORARY_INDEX_FILE_NAME).exists()
+
+
+def test_access_order_does_not_depend_on_clock(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Accesses within the same clock tick are still ordered.
+    """
+    monkeypatch.setattr(time, "time_ns", lambda: 0)
+    cache = encode_cache.EncodeCache(tmp_path, 300)
+    cache.put("a", make_result(100))
+    cache.put("b", make_result(100))
+    cache.put("c", make_result(100))
+    assert cache.get("a") is not None
+
+    cache.put("d", make_result(100))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+
+def test_make_key_depends_on_every_field() -> None:
+    """
+    Changing any part of an encode changes its key.
+    """
+    key = encode_cache.make_key("hash", "PNG", {"compress_level": 6}, "1.0")
+
+    assert key == encode_cache.make_key("hash", "PNG", {"compress_level": 6}, "1.0")
+    assert key != encode_cache.make_key("other", "PNG", {"compress_level": 6}, "1.0")
+    assert key != encode_cache.make_key("hash", "JPEG", {"compress_level": 6}, "1.0")
+    assert key != encode_cache.make_key("hash", "PNG", {"compress_level": 5}, "1.0")
+    assert key != encode_cache.make_key("hash", "PNG", {"compress_level": 6}, "1.1")
@@ -0,0 +1,78 @@
+"""
+Tests for the background frame reader.
+"""
+
+import pathlib
+
+import pytest
+from PIL import Image
+
+import frame_reader
+
+
+def write_frames(path: pathlib.Path, count: int) -> None:
+    """
+    Writes frames named <frame index>.png with the frame index as their colour.
+    """
+    for frame_index in range(count):
+        Image.new("L", (8, 4), frame_index).save(pathlib.Path(path, f"{frame_index}.png"))
+
+
+@pytest.mark.parametrize("depth", [0, 1, 3])
+def test_frames_in_order(tmp_path: pathlib.Path, depth: int) -> None:
+    """
+    Frames are returned decoded and in the requested order.
+    """
+    write_frames(tmp_path, 5)
+    frames = frame_reader.FramePrefetcher(tmp_path, [4, 0, 2], depth, 1 << 20)
+    frames.start()
+
+    for expected_index in [4, 0, 2]:
+        frame_index, image, stall_time_ns = frames.get()
+        assert frame_index == expected_index
+        assert image.getpixel((0, 0)) == expected_index
+        assert stall_time_ns >= 0
+
+    with pytest.raises(IndexError):
+        frames.get()
+    frames.stop()
+
+
+def test_memory_bound_still_buffers_one_frame(tmp_path: pathlib.Path) -> None:
+    """
+    A frame larger than the memory bound is still read.
+    """
+    write_frames(tmp_path, 3)
+    frames = frame_reader.FramePrefetcher(tmp_path, range(3), 8, 1)
+    frames.start()
+
+    assert [frames.get()[0] for _ in range(3)] == [0, 1, 2]
+    frames.stop()
+
+
+def test_missing_frame_raises(tmp_path: pathlib.Path) -> None:
+    """
+    A frame that cannot be read raises in get() after the frames before it.
+    """
+    write_frames(tmp_path, 1)
+    frames = frame_reader.FramePrefetcher(tmp_path, range(2), 4, 1 << 20)
+    frames.start()
+
+    assert frames.get()[0] == 0
+    with pytest.raises(OSError):
+        frames.get()
+    frames.stop()
+
+
+def test_decode_error_raises(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Errors other than OSError also reach get() instead of leaving it waiting.
+    """
+    write_frames(tmp_path, 1)
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1)
+    frames = frame_reader.FramePrefetcher(tmp_path, range(1), 4, 1 << 20)
+    frames.start()
+
+    with pytest.raises(Image.DecompressionBombError):
+        frames.get()
+    frames.stop()
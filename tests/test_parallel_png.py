@@ -0,0 +1,177 @@
+"""
+Tests for the parallel PNG encoder.
+"""
+
+import collections.abc
+import concurrent.futures
+import io
+import itertools
+import struct
+import zlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import parallel_png
+
+
+COMPRESS_TYPES = [0, 1, 2, 3, 4]
+MODES = ["L", "LA", "RGB", "RGBA"]
+
+
+@pytest.fixture(scope="module", name="thread_pool")
+def thread_pool_fixture() -> collections.abc.Iterator[concurrent.futures.ThreadPoolExecutor]:
+    """
+    Executor shared by the tests.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(4)
+    yield executor
+    executor.shutdown()
+
+
+def make_image(mode: str, width: int, height: int, seed: int = 0) -> Image.Image:
+    """
+    Image with smooth areas and noise, so that every row filter gets chosen.
+    """
+    channels = parallel_png.COLOUR_TYPES[mode][1]
+    rng = np.random.default_rng(seed)
+    gradient = np.add.outer(np.arange(height), np.arange(width)).astype(np.uint8)
+    pixels = np.repeat(gradient[:, :, np.newaxis], channels, axis=2)
+    noise = rng.integers(0, 256, (height, width, channels), dtype=np.uint8)
+    pixels[height // 2 :] = noise[height // 2 :]
+    if channels == 1:
+        pixels = pixels[:, :, 0]
+
+    return Image.fromarray(pixels, mode)
+
+
+def read_idat(png: bytes) -> "list[bytes]":
+    """
+    Data of the IDAT chunks of a PNG, checking the CRC of every chunk.
+    """
+    assert png[:8] == parallel_png.PNG_SIGNATURE
+
+    idat = []
+    position = 8
+    while position < len(png):
+        (length,) = struct.unpack(">I", png[position : position + 4])
+        chunk_type = png[position + 4 : position + 8]
+        data = png[position + 8 : position + 8 + length]
+        (crc,) = struct.unpack(">I", png[position + 8 + length : position + 12 + length])
+        assert crc == zlib.crc32(chunk_type + data)
+        if chunk_type == b"IDAT":
+            idat.append(data)
+        position += 12 + length
+
+    return idat
+
+
+def check_round_trip(image: Image.Image, png: bytes, multiple_idat: bool) -> None:
+    """
+    The PNG decodes to the original image and is one valid zlib stream.
+    """
+    decoded = Image.open(io.BytesIO(png))
+    decoded.load()
+    assert decoded.mode == image.mode
+    assert decoded.size == image.size
+    assert np.array_equal(np.asarray(decoded), np.asarray(image))
+
+    idat = read_idat(png)
+    if not multiple_idat:
+        assert len(idat) == 1
+    # Checks the combined Adler-32
+    raw = zlib.decompress(b"".join(idat))
+    channels = parallel_png.COLOUR_TYPES[image.mode][1]
+    assert len(raw) == image.height * (image.width * channels + 1)
+
+
+@pytest.mark.parametrize(
+    "mode, compress_type, multiple_idat",
+    list(itertools.product(MODES, COMPRESS_TYPES, [False, True])),
+)
+def test_round_trip(
+    thread_pool: concurrent.futures.ThreadPoolExecutor,
+    mode: str,
+    compress_type: int,
+    multiple_idat: bool,
+) -> None:
+    """
+    Every mode and strategy round trips through Pillow, over many chunks.
+    """
+    image = make_image(mode, 97, 61)
+    # A few rows per chunk
+    png = parallel_png.encode(image, 6, compress_type, thread_pool, 1000, multiple_idat)
+
+    check_round_trip(image, png, multiple_idat)
+
+
+@pytest.mark.parametrize(
+    "mode, size, chunk_size_B",
+    list(itertools.product(MODES, [(1, 1), (1, 7), (7, 1), (3, 2)], [1, 64, 1 << 20])),
+)
+def test_round_trip_tiny(
+    thread_pool: concurrent.futures.ThreadPoolExecutor,
+    mode: str,
+    size: "tuple[int, int]",
+    chunk_size_B: int,
+) -> None:
+    """
+    Images smaller than a chunk or a row round trip.
+    """
+    image = make_image(mode, *size)
+
+    for multiple_idat in [False, True]:
+        png = parallel_png.encode(image, 9, 0, thread_pool, chunk_size_B, multiple_idat)
+        check_round_trip(image, png, multiple_idat)
+
+
+def test_dictionary_spans_chunks(thread_pool: concurrent.futures.ThreadPoolExecutor) -> None:
+    """
+    Rows taller than the window and chunks smaller than the window round trip,
+    and a repeated image compresses as well as with Pillow.
+    """
+    tile = np.asarray(make_image("RGB", 200, 50, seed=1))
+    image = Image.fromarray(np.tile(tile, (8, 1, 1)), "RGB")
+    png = parallel_png.encode(image, 9, 0, thread_pool, 4096)
+
+    check_round_trip(image, png, False)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=9)
+    assert len(png) < 1.5 * buffer.getbuffer().nbytes
+
+
+def test_round_trip_process_pool() -> None:
+    """
+    Chunks can be compressed in worker processes.
+    """
+    image = make_image("RGBA", 64, 64)
+    with concurrent.futures.ProcessPoolExecutor(2) as executor:
+        for multiple_idat in [False, True]:
+            png = parallel_png.encode(image, 1, 0, executor, 1024, multiple_idat)
+            check_round_trip(image, png, multiple_idat)
+
+
+def test_unsupported_mode(thread_pool: concurrent.futures.ThreadPoolExecutor) -> None:
+    """
+    Modes other than 8 bit greyscale and truecolour are rejected.
+    """
+    for mode in ["1", "P", "I;16", "CMYK"]:
+        with pytest.raises(ValueError):
+            parallel_png.encode(Image.new(mode, (4, 4)), 6, 0, thread_pool)
+
+
+@pytest.mark.parametrize("length1, length2", [(0, 0), (0, 10), (10, 0), (1, 1), (5552, 70000)])
+def test_adler32_combine(length1: int, length2: int) -> None:
+    """
+    Combining matches the Adler-32 of the concatenated data.
+    """
+    rng = np.random.default_rng(length1 + length2)
+    data1 = rng.integers(0, 256, length1, dtype=np.uint8).tobytes()
+    # All 0xFF maximizes the sums
+    data2 = bytes([0xFF]) * length2
+
+    combined = parallel_png.adler32_combine(zlib.adler32(data1), zlib.adler32(data2), length2)
+
+    assert combined == zlib.adler32(data1 + data2)
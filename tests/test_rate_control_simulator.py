@@ -0,0 +1,166 @@
+"""
+Tests for the rate control simulator.
+"""
+
+import math
+
+import pytest
+
+import rate_control_simulator
+
+
+def test_send_constant_bandwidth() -> None:
+    """
+    A frame takes its size over the bandwidth to send.
+    """
+    link = rate_control_simulator.Link([(0.0, 1000.0)])
+
+    assert link.send(1.0, 500) == pytest.approx(1.5)
+    assert link.free_s == pytest.approx(1.5)
+
+
+def test_send_waits_for_previous_frame() -> None:
+    """
+    Frames are sent one at a time.
+    """
+    link = rate_control_simulator.Link([(0.0, 1000.0)])
+    link.send(0.0, 1000)
+
+    assert link.send(0.5, 1000) == pytest.approx(2.0)
+    # Link is idle by the time this frame is ready
+    assert link.send(3.0, 1000) == pytest.approx(4.0)
+
+
+def test_send_across_bandwidth_changes() -> None:
+    """
+    A frame sent over a bandwidth change uses the bandwidth of each segment.
+    """
+    link = rate_control_simulator.Link([(0.0, 1000.0), (1.0, 0.0), (2.0, 500.0)])
+
+    # 500 B until 1 s, nothing until 2 s, then 500 B in 1 s
+    assert link.send(0.5, 1000) == pytest.approx(3.0)
+
+
+def test_send_never_received_when_link_goes_down() -> None:
+    """
+    A frame that is not fully sent before the link goes down for good is never received.
+    """
+    link = rate_control_simulator.Link([(0.0, 1000.0), (1.0, 0.0)])
+
+    assert math.isinf(link.send(0.5, 1000))
+    assert math.isinf(link.send(2.0, 1))
+
+
+def test_capacity_across_bandwidth_changes() -> None:
+    """
+    Capacity is the integral of the bandwidth.
+    """
+    link = rate_control_simulator.Link([(0.0, 1000.0), (1.0, 0.0), (2.0, 500.0)])
+
+    assert link.capacity_B(0.5, 3.0) == pytest.approx(500 + 0 + 500)
+    assert link.capacity_B(2.5, 2.5) == 0
+    assert link.bandwidth_Bps(1.5) == 0
+    assert link.bandwidth_Bps(10.0) == 500
+
+
+def make_frame_data(size_B: int, time_ns: int = 0) -> "list[dict]":
+    """
+    Per-frame data of a setting that always encodes to size_B in time_ns.
+    """
+    return [{"size_B": size_B, "time_ns": time_ns}] * 4
+
+
+def test_load_settings_order() -> None:
+    """
+    Settings are sorted by quality, then by size descending.
+    """
+    results = {
+        "quality_90": {"chroma_420": {"frame_data": make_frame_data(200)}},
+        "quality_10": {"chroma_420": {"frame_data": make_frame_data(50)}},
+        "compress_level_1": {"frame_data": make_frame_data(90)},
+        "compress_level_6": {"frame_data": make_frame_data(40)},
+    }
+
+    settings = rate_control_simulator.load_settings(results)
+
+    assert [setting.name for setting in settings] == [
+        "quality_10/chroma_420",
+        "quality_90/chroma_420",
+        "compress_level_1",
+        "compress_level_6",
+    ]
+
+
+def test_pid_moves_towards_larger_settings_below_target() -> None:
+    """
+    The PID chooses larger settings when frames are smaller than the target,
+    even when size is not monotonic in the order of the settings.
+    """
+    # Lossless settings get larger as the index decreases
+    settings = [
+        rate_control_simulator.Setting(f"compress_level_{level}", 100, make_frame_data(size_B))
+        for level, size_B in [(1, 90), (2, 80), (3, 70), (4, 60), (5, 50), (6, 40)]
+    ]
+    link = rate_control_simulator.Link([(0.0, 1e9)])
+
+    policy = rate_control_simulator.PidSizePolicy(settings)
+    policy.update(1, 0.0, link)
+
+    assert policy.select(0.0, 0.0, link, settings) == 0
+
+    link = rate_control_simulator.Link([(0.0, 1.0)])
+    policy = rate_control_simulator.PidSizePolicy(settings)
+    policy.update(1_000_000, 0.0, link)
+
+    assert policy.select(0.0, 0.0, link, settings) == len(settings) - 1
+
+
+def test_pid_skips_settings_slower_than_frame_interval() -> None:
+    """
+    The PID does not choose a setting the encoder cannot keep up with, however small.
+    """
+    settings = [
+        rate_control_simulator.Setting("quality_50", 50, make_frame_data(1000, 10_000_000)),
+        rate_control_simulator.Setting("quality_90", 90, make_frame_data(100, 1_000_000_000)),
+    ]
+    link = rate_control_simulator.Link([(0.0, 1.0)])
+
+    policy = rate_control_simulator.PidSizePolicy(settings)
+    policy.update(1_000_000, 0.0, link)
+
+    assert policy.select(0.0, 0.0, link, settings) == 0
+
+
+def test_lookup_accounts_for_encode_time() -> None:
+    """
+    The lookup does not choose a setting that is small enough to send in time
+    but too slow to encode within the latency target.
+    """
+    link = rate_control_simulator.Link([(0.0, 1e6)])
+    policy = rate_control_simulator.LookupPolicy()
+
+    settings = [
+        rate_control_simulator.Setting("quality_50", 50, make_frame_data(1000, 10_000_000)),
+        rate_control_simulator.Setting("quality_90", 90, make_frame_data(100, 10_000_000)),
+    ]
+    assert policy.select(0.0, 0.0, link, settings) == 1
+
+    settings[1] = rate_control_simulator.Setting(
+        "quality_90", 90, make_frame_data(100, 1_000_000_000)
+    )
+    assert policy.select(0.0, 0.0, link, settings) == 0
+
+
+def test_lookup_accounts_for_encoder_backlog() -> None:
+    """
+    Time spent waiting for the encoder to finish the previous frames counts towards the latency.
+    """
+    link = rate_control_simulator.Link([(0.0, 1e6)])
+    policy = rate_control_simulator.LookupPolicy()
+    settings = [
+        rate_control_simulator.Setting("quality_50", 50, make_frame_data(1000, 10_000_000)),
+        rate_control_simulator.Setting("quality_90", 90, make_frame_data(100, 200_000_000)),
+    ]
+
+    assert policy.select(0.0, 0.0, link, settings) == 1
+    assert policy.select(0.0, 0.4, link, settings) == 0
@@ -0,0 +1,584 @@
+"""
+Benchmarks previews of each frame that ground operators can show before the full image arrives,
+on a given set of images (300 landing pad images captured from a flight test).
+
+Preview modes:
+    embedded: thumbnail embedded in the HEIF or AVIF container
+    separate: downscaled copy of the frame sent as its own low resolution image
+    draft: JPEG only, the receiver decodes the full image at a reduced DCT scale (no extra bytes)
+
+Reports the extra encode time and bytes over encoding the frame without a preview,
+as well as the time for the receiver to decode just the preview and the full image.
+
+pillow_heif reports the embedded thumbnails of a container but cannot decode them,
+so the decode time of an embedded thumbnail is the time to parse the container
+and decode a standalone image of the same size encoded with the same settings.
+
+Creates a folder with the image and preview for each setting to visually check the quality,
+as well as a .json with the test data and a .csv which provides a more human-friendly summary
+of the data.
+"""
+
+import gc
+import io
+import json
+import pathlib
+import time
+
+import pillow_heif
+from PIL import Image
+
+import cpu_usage
+import encode_cache
+import run_environment
+
+
+# Setting parameters
+FRAME_COUNT = 300  # Total number of frames
+FRAME_TO_SAVE = 69  # This frame is good, it has both landing pads in it
+INPUT_PATH = pathlib.Path("test_images", "Encode Test Dataset 2024")
+OUTPUT_PATH = pathlib.Path("logs", str(int(time.time())))
+FORMAT = "HEIF"  # HEIF, AVIF, JPEG or PNG
+QUALITY = 70  # HEIF, AVIF and JPEG
+CHROMA = 420  # HEIF and AVIF
+PNG_COMPRESS_LEVEL = 6
+
+# Modes not supported by FORMAT are skipped
+PREVIEW_MODES = ["embedded", "separate", "draft"]
+EMBEDDED_FORMATS = ["HEIF", "AVIF"]
+DRAFT_FORMATS = ["JPEG"]
+# Largest side of the preview in pixels
+THUMBNAIL_BOXES = [64, 128, 256]
+# Separate preview
+PREVIEW_FORMAT = "JPEG"
+PREVIEW_QUALITY = 50
+PREVIEW_RESAMPLE = Image.Resampling.BILINEAR
+# Downscale by an integer factor first (faster), see Image.thumbnail()
+PREVIEW_REDUCING_GAP = 2.0
+
+# Encode cache, results of a cache hit include the timing of the run that created the entry
+# so the cache must be disabled for timing runs
+USE_ENCODE_CACHE = False
+CACHE_ENCODED_BYTES = False
+ENCODE_CACHE_PATH = pathlib.Path("logs", "encode_cache")
+ENCODE_CACHE_MAX_SIZE_B = 1 << 30  # 1 GiB
+
+# Time between samples of CPU frequency, load and throttling
+MONITOR_INTERVAL_S = 0.5
+
+# Keys for dictionary entries
+AVG_TIME_MS = "avg_time_ms"
+AVG_BASELINE_TIME_MS = "avg_baseline_time_ms"
+AVG_EXTRA_TIME_MS = "avg_extra_time_ms"
+AVG_USER_TIME_MS = "avg_user_time_ms"
+AVG_SYSTEM_TIME_MS = "avg_system_time_ms"
+AVG_CPU_TIME_MS = "avg_cpu_time_ms"
+AVG_CORES_USED = "avg_cores_used"
+AVG_CPU_UTILIZATION = "avg_cpu_utilization_%"
+AVG_SIZE_B = "avg_size_B"
+AVG_BASELINE_SIZE_B = "avg_baseline_size_B"
+AVG_EXTRA_SIZE_B = "avg_extra_size_B"
+AVG_EXTRA_SIZE_RATIO = "avg_extra_size_ratio_%"
+MIN_PREVIEW_DECODE_TIME_MS = "min_preview_decode_time_ms"
+MAX_PREVIEW_DECODE_TIME_MS = "max_preview_decode_time_ms"
+AVG_PREVIEW_DECODE_TIME_MS = "avg_preview_decode_time_ms"
+AVG_FULL_DECODE_TIME_MS = "avg_full_decode_time_ms"
+FRAME_DATA = "frame_data"
+START_TIME_NS = "start_time_ns"
+END_TIME_NS = "end_time_ns"
+CONTENTION = "contention"
+CACHED_FRAME_COUNT = "cached_frame_count"
+
+# For output csv file
+HEADERS = [
+    "Preview Mode",
+    "Thumbnail Box (px)",
+    "Avg Time (ms)",
+    "Avg Baseline Time (ms)",
+    "Avg Extra Time (ms)",
+    "Avg User Time (ms)",
+    "Avg System Time (ms)",
+    "Avg CPU Time (ms)",
+    "Avg Cores Used",
+    "Avg CPU Utilization (%)",
+    "Avg Size (B)",
+    "Avg Baseline Size (B)",
+    "Avg Extra Size (B)",
+    "Avg Extra Size Ratio (extra to baseline in %)",
+    "Min Preview Decode Time (ms)",
+    "Max Preview Decode Time (ms)",
+    "Avg Preview Decode Time (ms)",
+    "Avg Full Decode Time (ms)",
+    "Cached Frames",
+    "Contended",
+]
+HEADER_LINE = ",".join(HEADERS) + "\n"
+
+
+def update_min_max(
+    min_value: "int | float",
+    max_value: "int | float",
+    current_value: "int | float",
+) -> "tuple[int, int] | tuple[float, float]":
+    """
+    Updates the min and max values for a measurement.
+
+    Args:
+        min_value: previous minimum value
+        max_value: previous maximum value
+        current_value: currently measured value
+
+    Returns: (min_value, max_value)
+        min_value: new updated minimum recorded value
+        max_value: new updated maximum recorded value
+
+        The intended output is something like [int, int] or [float, float],
+        but it is not guaranteed because the inputs could be a combination of int and float.
+        eg. could also be tuple[float, int]
+    """
+    if current_value < min_value:
+        min_value = current_value
+    if current_value > max_value:
+        max_value = current_value
+
+    return min_value, max_value
+
+
+def get_save_parameters() -> dict:
+    """
+    Parameters to save the full image in FORMAT with.
+    """
+    if FORMAT in EMBEDDED_FORMATS:
+        return {"quality": QUALITY, "chroma": CHROMA}
+
+    if FORMAT == "JPEG":
+        return {"quality": QUALITY}
+
+    return {"compress_level": PNG_COMPRESS_LEVEL}
+
+
+def is_preview_mode_supported(preview_mode: str) -> bool:
+    """
+    Whether the preview mode can be used with FORMAT.
+    """
+    if preview_mode == "embedded":
+        return FORMAT in EMBEDDED_FORMATS
+
+    if preview_mode == "draft":
+        return FORMAT in DRAFT_FORMATS
+
+    return True
+
+
+def make_preview(image: Image.Image, box: int) -> Image.Image:
+    """
+    Downscales the image to fit in a box x box square, keeping the aspect ratio.
+    """
+    preview = image.copy()
+    preview.thumbnail((box, box), PREVIEW_RESAMPLE, PREVIEW_REDUCING_GAP)
+
+    return preview
+
+
+def encode(
+    image: Image.Image, preview_mode: "str | None", box: int
+) -> "tuple[bytes, bytes | None]":
+    """
+    Encodes the full image and its preview.
+
+    Args:
+        image: loaded frame
+        preview_mode: one of PREVIEW_MODES, None to encode without a preview
+        box: largest side of the preview
+
+    Returns: (data, preview_data)
+        data: full image, including the embedded thumbnail
+        preview_data: separate preview, None for the other modes
+    """
+    buffer = io.BytesIO()
+    if preview_mode == "embedded":
+        image.save(buffer, format=FORMAT, thumbnails=[box], **get_save_parameters())
+    else:
+        image.save(buffer, format=FORMAT, **get_save_parameters())
+
+    if preview_mode != "separate":
+        return buffer.getvalue(), None
+
+    preview_buffer = io.BytesIO()
+    make_preview(image, box).save(preview_buffer, format=PREVIEW_FORMAT, quality=PREVIEW_QUALITY)
+
+    return buffer.getvalue(), preview_buffer.getvalue()
+
+
+def decode_preview(
+    data: bytes,
+    preview_data: "bytes | None",
+    preview_mode: str,
+    box: int,
+) -> Image.Image:
+    """
+    Decodes just the preview on the receive side.
+
+    Args:
+        data: full image
+        preview_data: separate preview, or standalone thumbnail for the embedded mode
+        preview_mode: one of PREVIEW_MODES
+        box: largest side of the preview
+
+    Returns: decoded preview
+    """
+    if preview_mode == "draft":
+        preview = Image.open(io.BytesIO(data))
+        # Largest DCT scale with both sides at least box
+        preview.draft("RGB", (box, box))
+        preview.load()
+        return preview
+
+    if preview_mode == "embedded":
+        # Find the thumbnail in the container without decoding the full image
+        # (libheif does not embed thumbnails at least as large as the image)
+        pillow_heif.open_heif(io.BytesIO(data)).info.get("thumbnails")
+
+    preview = Image.open(io.BytesIO(preview_data))
+    preview.load()
+
+    return preview
+
+
+def main() -> int:
+    """
+    Main function.
+    """
+    if FORMAT == "AVIF":
+        pillow_heif.register_avif_opener(thumbnails=True)
+    else:
+        pillow_heif.register_heif_opener(thumbnails=True)
+
+    preview_modes = [
+        preview_mode for preview_mode in PREVIEW_MODES if is_preview_mode_supported(preview_mode)
+    ]
+    if len(preview_modes) == 0:
+        print(f"No preview mode supports {FORMAT}")
+        return -1
+
+    OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
+
+    results = {
+        f"preview_mode_{preview_mode}": {
+            f"box_{box}": {
+                AVG_TIME_MS: 0,
+                AVG_BASELINE_TIME_MS: 0,
+                AVG_EXTRA_TIME_MS: 0,
+                AVG_USER_TIME_MS: 0,
+                AVG_SYSTEM_TIME_MS: 0,
+                AVG_CPU_TIME_MS: 0,
+                AVG_CORES_USED: 0,
+                AVG_CPU_UTILIZATION: 0,
+                AVG_SIZE_B: 0,
+                AVG_BASELINE_SIZE_B: 0,
+                AVG_EXTRA_SIZE_B: 0,
+                # % of the size without a preview
+                AVG_EXTRA_SIZE_RATIO: 0,
+                MIN_PREVIEW_DECODE_TIME_MS: 0,
+                MAX_PREVIEW_DECODE_TIME_MS: 0,
+                AVG_PREVIEW_DECODE_TIME_MS: 0,
+                AVG_FULL_DECODE_TIME_MS: 0,
+                FRAME_DATA: [],
+            }
+            for box in THUMBNAIL_BOXES
+        }
+        for preview_mode in preview_modes
+    }
+
+    encoder_version = (
+        run_environment.get_encoder_version(FORMAT)
+        + "/"
+        + run_environment.get_encoder_version(PREVIEW_FORMAT)
+    )
+
+    cache = None
+    frame_hashes = []
+    if USE_ENCODE_CACHE:
+        cache = encode_cache.EncodeCache(ENCODE_CACHE_PATH, ENCODE_CACHE_MAX_SIZE_B)
+        frame_hashes = [
+            encode_cache.hash_file(pathlib.Path(INPUT_PATH, f"{frame_index}.png"))
+            for frame_index in range(FRAME_COUNT)
+        ]
+
+    fingerprint = run_environment.get_fingerprint()
+    monitor = run_environment.EnvironmentMonitor(MONITOR_INTERVAL_S)
+    monitor.start()
+    cell_results = []
+
+    test_begin = time.time()
+    print("Start time:", test_begin)
+
+    for preview_mode in preview_modes:
+        print(f"-----------------PREVIEW MODE = {preview_mode}--------------------")
+        for box in THUMBNAIL_BOXES:
+            total_time_ns = 0
+            total_baseline_time_ns = 0
+            total_user_time_ns = 0
+            total_system_time_ns = 0
+            total_size_B = 0
+            total_baseline_size_B = 0
+            total_extra_size_ratio = 0
+            min_preview_decode_time_ns = float("inf")
+            max_preview_decode_time_ns = 0
+            total_preview_decode_time_ns = 0
+            total_full_decode_time_ns = 0
+            cached_frame_count = 0
+            current_result = results[f"preview_mode_{preview_mode}"][f"box_{box}"]
+            current_result[START_TIME_NS] = time.time_ns()
+            for frame_index in range(FRAME_COUNT):
+                img = Image.open(pathlib.Path(INPUT_PATH, f"{frame_index}.png"))
+                # Decode before timing so that the baseline and preview encodes are comparable
+                img.load()
+
+                cache_key = None
+                cached = None
+                if cache is not None:
+                    cache_key = encode_cache.make_key(
+                        frame_hashes[frame_index],
+                        f"{FORMAT}_preview",
+                        {
+                            **get_save_parameters(),
+                            "preview_mode": preview_mode,
+                            "box": box,
+                            "preview_format": PREVIEW_FORMAT,
+                            "preview_quality": PREVIEW_QUALITY,
+                        },
+                        encoder_version,
+                    )
+                    cached = cache.get(cache_key)
+
+                if cached is not None:
+                    test_result = cached[0]
+                    cached_frame_count += 1
+                else:
+                    # Running encode without a preview
+                    gc.disable()
+                    start = time.time_ns()
+                    baseline_data, _ = encode(img, None, box)
+                    end = time.time_ns()
+                    gc.enable()
+                    baseline_time_ns = end - start
+
+                    # Running encode with the preview
+                    gc.disable()
+                    start_user_ns, start_system_ns = cpu_usage.get_cpu_times_ns()
+                    start = time.time_ns()
+                    data, preview_data = encode(img, preview_mode, box)
+                    end = time.time_ns()
+                    end_user_ns, end_system_ns = cpu_usage.get_cpu_times_ns()
+                    gc.enable()
+
+                    time_ns = end - start
+                    user_time_ns = end_user_ns - start_user_ns
+                    system_time_ns = end_system_ns - start_system_ns
+                    size_B = len(data) + (len(preview_data) if preview_data is not None else 0)
+
+                    if preview_mode == "embedded":
+                        # Stand-in for the embedded thumbnail, which pillow_heif cannot decode
+                        thumbnail_buffer = io.BytesIO()
+                        make_preview(img, box).save(
+                            thumbnail_buffer,
+                            format=FORMAT,
+                            **get_save_parameters(),
+                        )
+                        preview_data = thumbnail_buffer.getvalue()
+
+                    # Running decode on the receive side
+                    gc.disable()
+                    start = time.time_ns()
+                    preview = decode_preview(data, preview_data, preview_mode, box)
+                    end = time.time_ns()
+                    gc.enable()
+                    preview_decode_time_ns = end - start
+
+                    gc.disable()
+                    start = time.time_ns()
+                    with Image.open(io.BytesIO(data)) as full_image:
+                        full_image.load()
+                    end = time.time_ns()
+                    gc.enable()
+                    full_decode_time_ns = end - start
+
+                    # Save singular test results
+                    test_result = {
+                        "time_ns": time_ns,
+                        "baseline_time_ns": baseline_time_ns,
+                        "extra_time_ns": time_ns - baseline_time_ns,
+                        "user_time_ns": user_time_ns,
+                        "system_time_ns": system_time_ns,
+                        "cores_used": cpu_usage.get_cores_used(
+                            user_time_ns + system_time_ns,
+                            time_ns,
+                        ),
+                        "cpu_utilization_%": cpu_usage.get_cpu_utilization(
+                            user_time_ns + system_time_ns,
+                            time_ns,
+                        ),
+                        "size_B": size_B,
+                        "baseline_size_B": len(baseline_data),
+                        "extra_size_B": size_B - len(baseline_data),
+                        "extra_size_ratio_%": 100
+                        * (size_B - len(baseline_data))
+                        / len(baseline_data),
+                        "preview_width": preview.width,
+                        "preview_height": preview.height,
+                        "preview_decode_time_ns": preview_decode_time_ns,
+                        "full_decode_time_ns": full_decode_time_ns,
+                    }
+
+                min_preview_decode_time_ns, max_preview_decode_time_ns = update_min_max(
+                    min_preview_decode_time_ns,
+                    max_preview_decode_time_ns,
+                    test_result["preview_decode_time_ns"],
+                )
+
+                total_time_ns += test_result["time_ns"]
+                total_baseline_time_ns += test_result["baseline_time_ns"]
+                total_user_time_ns += test_result["user_time_ns"]
+                total_system_time_ns += test_result["system_time_ns"]
+                total_size_B += test_result["size_B"]
+                total_baseline_size_B += test_result["baseline_size_B"]
+                total_extra_size_ratio += test_result["extra_size_ratio_%"]
+                total_preview_decode_time_ns += test_result["preview_decode_time_ns"]
+                total_full_decode_time_ns += test_result["full_decode_time_ns"]
+                # Timing is from the run that created the cache entry
+                test_result["cached"] = cached is not None
+                current_result[FRAME_DATA].append(test_result)
+
+                if cache is not None and cached is None:
+                    cache.put(
+                        cache_key,
+                        test_result,
+                        data if CACHE_ENCODED_BYTES else None,
+                    )
+
+                # Save one image (this one has 2 landing pads in it) and its preview for reference
+                if frame_index == FRAME_TO_SAVE:
+                    data, preview_data = encode(img, preview_mode, box)
+                    pathlib.Path(
+                        OUTPUT_PATH,
+                        f"{preview_mode}_b{box}.{FORMAT.lower()}",
+                    ).write_bytes(data)
+                    if preview_data is not None:
+                        pathlib.Path(
+                            OUTPUT_PATH,
+                            f"{preview_mode}_b{box}_preview.{PREVIEW_FORMAT.lower()}",
+                        ).write_bytes(preview_data)
+
+            current_result[END_TIME_NS] = time.time_ns()
+            current_result[CACHED_FRAME_COUNT] = cached_frame_count
+            cell_results.append(current_result)
+
+            # Save average test results
+            current_result[AVG_TIME_MS] = total_time_ns / FRAME_COUNT / 1e6
+            current_result[AVG_BASELINE_TIME_MS] = total_baseline_time_ns / FRAME_COUNT / 1e6
+            current_result[AVG_EXTRA_TIME_MS] = (
+                (total_time_ns - total_baseline_time_ns) / FRAME_COUNT / 1e6
+            )
+            current_result[AVG_USER_TIME_MS] = total_user_time_ns / FRAME_COUNT / 1e6
+            current_result[AVG_SYSTEM_TIME_MS] = total_system_time_ns / FRAME_COUNT / 1e6
+            current_result[AVG_CPU_TIME_MS] = (
+                (total_user_time_ns + total_system_time_ns) / FRAME_COUNT / 1e6
+            )
+            current_result[AVG_CORES_USED] = cpu_usage.get_cores_used(
+                total_user_time_ns + total_system_time_ns,
+                total_time_ns,
+            )
+            current_result[AVG_CPU_UTILIZATION] = cpu_usage.get_cpu_utilization(
+                total_user_time_ns + total_system_time_ns,
+                total_time_ns,
+            )
+            current_result[AVG_SIZE_B] = total_size_B / FRAME_COUNT
+            current_result[AVG_BASELINE_SIZE_B] = total_baseline_size_B / FRAME_COUNT
+            current_result[AVG_EXTRA_SIZE_B] = (total_size_B - total_baseline_size_B) / FRAME_COUNT
+            current_result[AVG_EXTRA_SIZE_RATIO] = total_extra_size_ratio / FRAME_COUNT
+            current_result[MIN_PREVIEW_DECODE_TIME_MS] = min_preview_decode_time_ns / 1e6
+            current_result[MAX_PREVIEW_DECODE_TIME_MS] = max_preview_decode_time_ns / 1e6
+            current_result[AVG_PREVIEW_DECODE_TIME_MS] = (
+                total_preview_decode_time_ns / FRAME_COUNT / 1e6
+            )
+            current_result[AVG_FULL_DECODE_TIME_MS] = total_full_decode_time_ns / FRAME_COUNT / 1e6
+            print(f"Box {box} complete")
+
+    if cache is not None:
+        cache.save()
+        print(f"Encode cache hits: {cache.hits}, misses: {cache.misses}")
+
+    # Flag settings timed under contention
+    monitor.stop()
+    contended_count = 0
+    for current_result in cell_results:
+        current_result[CONTENTION] = monitor.check(
+            current_result[START_TIME_NS],
+            current_result[END_TIME_NS],
+        )
+        contended_count += int(current_result[CONTENTION][run_environment.CONTENDED])
+    print(f"{contended_count} of {len(cell_results)} settings were timed under contention")
+
+    print("")
+    print("-------------------TEST COMPLETED------------------")
+    print("")
+
+    # Saving full results
+    with open(pathlib.Path(OUTPUT_PATH, "results.json"), "w", encoding="utf-8") as file:
+        file.write(json.dumps(results, indent=2))
+
+    # Saving run environment
+    with open(pathlib.Path(OUTPUT_PATH, "environment.json"), "w", encoding="utf-8") as file:
+        file.write(json.dumps({"fingerprint": fingerprint, "samples": monitor.samples}, indent=2))
+
+    # Saving shortcut results without frame data (for more human readability)
+    with open(pathlib.Path(OUTPUT_PATH, "summary.csv"), "w", encoding="utf-8") as file:
+        file.write(HEADER_LINE)
+        for preview_mode in preview_modes:
+            for box in THUMBNAIL_BOXES:
+                current_result = results[f"preview_mode_{preview_mode}"][f"box_{box}"]
+                line_stats = [
+                    preview_mode,
+                    str(box),
+                    str(current_result[AVG_TIME_MS]),
+                    str(current_result[AVG_BASELINE_TIME_MS]),
+                    str(current_result[AVG_EXTRA_TIME_MS]),
+                    str(current_result[AVG_USER_TIME_MS]),
+                    str(current_result[AVG_SYSTEM_TIME_MS]),
+                    str(current_result[AVG_CPU_TIME_MS]),
+                    str(current_result[AVG_CORES_USED]),
+                    str(current_result[AVG_CPU_UTILIZATION]),
+                    str(current_result[AVG_SIZE_B]),
+                    str(current_result[AVG_BASELINE_SIZE_B]),
+                    str(current_result[AVG_EXTRA_SIZE_B]),
+                    str(current_result[AVG_EXTRA_SIZE_RATIO]),
+                    str(current_result[MIN_PREVIEW_DECODE_TIME_MS]),
+                    str(current_result[MAX_PREVIEW_DECODE_TIME_MS]),
+                    str(current_result[AVG_PREVIEW_DECODE_TIME_MS]),
+                    str(current_result[AVG_FULL_DECODE_TIME_MS]),
+                    str(current_result[CACHED_FRAME_COUNT]),
+                    str(current_result[CONTENTION][run_environment.CONTENDED]),
+                ]
+                line = ",".join(line_stats) + "\n"
+                file.write(line)
+
+    test_end = time.time()
+    print("End time:", test_end)
+    print(
+        "Time taken:",
+        int((test_end - test_begin) / 60),
+        "mins",
+        int(test_end - test_begin) % 60,
+        "secs",
+    )
+
+    return 0
+
+
+if __name__ == "__main__":
+    result_main = main()
+    if result_main < 0:
+        print(f"ERROR: Status code: {result_main}")
+
+    print("Done!")